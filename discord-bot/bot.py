@@ -63,6 +63,7 @@ MINER_PATTERNS = [
     'xmrig', 'ethminer', 'cgminer', 'sgminer', 'bfgminer',
     'minerd', 'cpuminer', 'cryptonight', 'stratum', 'pool'
 ]
+MINER_REGEX = re.compile('|'.join(re.escape(pattern) for pattern in MINER_PATTERNS), re.IGNORECASE)
 
 # Dockerfile template for custom images
 DOCKERFILE_TEMPLATE = """
@@ -207,8 +208,7 @@ class Database:
         return result[0] if result else default
 
     def increment_stat(self, key, amount=1):
-        current = self.get_stat(key)
-        self.cursor.execute('INSERT OR REPLACE INTO usage_stats (key, value) VALUES (?, ?)', (key, current + amount))
+        self.cursor.execute('INSERT INTO usage_stats (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = value + excluded.value', (key, amount))
         self.conn.commit()
 
     def get_vps_by_id(self, vps_id):
@@ -401,16 +401,25 @@ class LexoNodesBot(commands.Bot):
         if not self.docker_client:
             return
             
+        # One listing instead of a containers.get() per VPS, off the event loop
+        try:
+            containers = await self.loop.run_in_executor(
+                None, lambda: {c.id: c for c in self.docker_client.containers.list(all=True)})
+        except Exception as e:
+            logger.error(f"Error listing containers: {e}")
+            return
+
         for token, vps in list(self.db.get_all_vps().items()):
             if vps['status'] == 'running':
+                container = containers.get(vps['container_id'])
+                if container is None:
+                    logger.warning(f"Container {vps['container_id']} not found, removing from data")
+                    self.db.remove_vps(token)
+                    continue
                 try:
-                    container = self.docker_client.containers.get(vps['container_id'])
                     if container.status != 'running':
-                        container.start()
+                        await self.loop.run_in_executor(None, container.start)
                     logger.info(f"Reconnected and started container for VPS {vps['vps_id']}")
-                except docker.errors.NotFound:
-                    logger.warning(f"Container {vps['container_id']} not found, removing from data")
-                    self.db.remove_vps(token)
                 except Exception as e:
                     logger.error(f"Error reconnecting container {vps['vps_id']}: {e}")
 
@@ -428,32 +437,36 @@ class LexoNodesBot(commands.Bot):
                     if vps['status'] != 'running':
                         continue
                     try:
-                        container = self.docker_client.containers.get(vps['container_id'])
-                        if container.status != 'running':
-                            continue
-                        
-                        # Check processes
-                        exec_result = container.exec_run("ps aux")
-                        output = exec_result.output.decode().lower()
-                        
-                        for pattern in MINER_PATTERNS:
-                            if pattern in output:
-                                logger.warning(f"Mining detected in VPS {vps['vps_id']}, suspending...")
-                                container.stop()
-                                self.db.update_vps(token, {'status': 'suspended'})
-                                # Notify owner
-                                try:
-                                    owner = await self.fetch_user(int(vps['created_by']))
-                                    await owner.send(f"⚠️ Your VPS {vps['vps_id']} has been suspended due to detected mining activity. Contact admin to unsuspend.")
-                                except:
-                                    pass
-                                break
+                        # Docker calls are blocking; keep them off the event loop
+                        detected = await self.loop.run_in_executor(None, self.check_for_miner, vps['container_id'])
+                        if detected:
+                            logger.warning(f"Mining detected in VPS {vps['vps_id']}, suspending...")
+                            self.db.update_vps(token, {'status': 'suspended'})
+                            # Notify owner
+                            try:
+                                owner = await self.fetch_user(int(vps['created_by']))
+                                await owner.send(f"⚠️ Your VPS {vps['vps_id']} has been suspended due to detected mining activity. Contact admin to unsuspend.")
+                            except:
+                                pass
+                    except docker.errors.NotFound:
+                        continue
                     except Exception as e:
                         logger.error(f"Error checking VPS {vps['vps_id']} for mining: {e}")
             except Exception as e:
                 logger.error(f"Error in anti_miner_monitor: {e}")
             await asyncio.sleep(300)  # Check every 5 minutes
 
+    def check_for_miner(self, container_id):
+        """Stop the container and return True if a miner is running in it"""
+        container = self.docker_client.containers.get(container_id)
+        if container.status != 'running':
+            return False
+        output = container.exec_run("ps aux").output.decode(errors='replace')
+        if not MINER_REGEX.search(output):
+            return False
+        container.stop()
+        return True
+
     async def update_system_stats(self):
         """Update system statistics periodically"""
         await self.wait_until_ready()
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+class CgroupReader:
+    """Per-container CPU, memory, IO and network counters read from cgroup v2 and /proc."""
+
+    SCOPES = ('system.slice/docker-{}.scope', 'docker/{}')
+
+    def __init__(self, cgroup_root='/sys/fs/cgroup', proc_root='/proc', max_age=10):
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        self.max_age = max_age
+        self.available = os.path.exists(os.path.join(cgroup_root, 'cgroup.controllers'))
+        self.host_cpus = os.cpu_count() or 1
+        self.host_memory = self.parse_meminfo(self._read(proc_root, 'meminfo'))
+        self.lock = threading.Lock()
+        self.previous = {}
+        self.samples = {}
+
+    @staticmethod
+    def parse_cpu_stat(text):
+        return {key: int(value) for key, value in (line.split() for line in text.splitlines() if line.strip())}
+
+    @staticmethod
+    def parse_meminfo(text):
+        for line in text.splitlines():
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) * 1024
+        return 0
+
+    @staticmethod
+    def parse_io_stat(text):
+        read_bytes = write_bytes = 0
+        for line in text.splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key == 'rbytes':
+                    read_bytes += int(value)
+                elif key == 'wbytes':
+                    write_bytes += int(value)
+        return read_bytes, write_bytes
+
+    @staticmethod
+    def parse_net_dev(text):
+        rx_bytes = tx_bytes = 0
+        for line in text.splitlines()[2:]:
+            iface, _, counters = line.partition(':')
+            fields = counters.split()
+            if iface.strip() == 'lo' or len(fields) < 9:
+                continue
+            rx_bytes += int(fields[0])
+            tx_bytes += int(fields[8])
+        return rx_bytes, tx_bytes
+
+    def _scope(self, container_id):
+        for scope in self.SCOPES:
+            path = os.path.join(self.cgroup_root, scope.format(container_id))
+            if os.path.isdir(path):
+                return path
+        return None
+
+    def readable(self, container_id):
+        return self.available and self._scope(container_id) is not None
+
+    def pids(self, container_id):
+        scope = self._scope(container_id)
+        if scope is None:
+            return None
+        try:
+            return [int(pid) for pid in self._read(scope, 'cgroup.procs').split()]
+        except (OSError, ValueError):
+            return None
+
+    def _read(self, *parts):
+        with open(os.path.join(*parts)) as f:
+            return f.read()
+
+    def read(self, container_id, now=None):
+        scope = self._scope(container_id)
+        if scope is None:
+            return None
+        try:
+            usage_usec = self.parse_cpu_stat(self._read(scope, 'cpu.stat'))['usage_usec']
+            memory_usage = int(self._read(scope, 'memory.current'))
+            memory_max = self._read(scope, 'memory.max').strip()
+            pids = self._read(scope, 'cgroup.procs').split()
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            io_read, io_write = self.parse_io_stat(self._read(scope, 'io.stat'))
+        except (OSError, ValueError):
+            io_read = io_write = 0
+        try:
+            net_rx, net_tx = self.parse_net_dev(self._read(self.proc_root, pids[0], 'net', 'dev')) if pids else (0, 0)
+        except (OSError, ValueError):
+            net_rx = net_tx = 0
+
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            previous = self.previous.get(container_id)
+            self.previous[container_id] = (usage_usec, now)
+        cpu_percent = 0.0
+        if previous and now > previous[1] and usage_usec >= previous[0]:
+            cpu_percent = (usage_usec - previous[0]) / ((now - previous[1]) * 1e6) * 100
+        return {
+            'cpu_percent': cpu_percent,
+            'cpu_host_percent': cpu_percent / self.host_cpus,
+            'online_cpus': self.host_cpus,
+            'memory_usage': memory_usage,
+            'memory_limit': self.host_memory if memory_max == 'max' else int(memory_max),
+            'net_rx': net_rx,
+            'net_tx': net_tx,
+            'io_read': io_read,
+            'io_write': io_write,
+            'read_at': time.time()
+        }
+
+    def sample_all(self, container_ids):
+        if not self.available:
+            return {}
+        samples = {}
+        for container_id in container_ids:
+            sample = self.read(container_id)
+            if sample:
+                samples[container_id] = sample
+        with self.lock:
+            self.samples = samples
+            self.previous = {cid: value for cid, value in self.previous.items() if cid in samples}
+        return samples
+
+    def get(self, container_id):
+        sample = self.samples.get(container_id)
+        if sample and time.time() - sample['read_at'] <= self.max_age:
+            return sample
+        return None
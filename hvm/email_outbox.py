@@ -0,0 +1,173 @@
+import logging
+import smtplib
+import time
+from email.mime.text import MIMEText
+
+from flusher import PeriodicFlusher
+
+logger = logging.getLogger('HVMPanel')
+
+class EmailOutbox(PeriodicFlusher):
+    """Delivers queued email_outbox rows over one reused SMTP session."""
+
+    def __init__(self, store, server, port, user, password, starttls=True, timeout=10, flush_interval=10,
+                 batch_size=50, max_attempts=6, retry_base=60, dedupe_window=3600, idle_timeout=60, metric=None):
+        super().__init__(flush_interval, 'Email outbox')
+        self.store = store
+        self.smtp = (server, port)
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.dedupe_window = dedupe_window
+        self.idle_timeout = idle_timeout
+        self.metric = metric
+        self.server = None
+        self.last_used = 0
+        self._create_table()
+
+    def _create_table(self):
+        self.store._execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                to_email TEXT NOT NULL,
+                subject TEXT,
+                body TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                created INTEGER,
+                next_attempt INTEGER,
+                last_error TEXT
+            )
+        ''')
+        self.store._execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt)')
+        self.store._execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_dedupe ON email_outbox (to_email, subject, created)')
+
+    def _count(self, result, amount=1):
+        if self.metric is not None:
+            self.metric.labels(result).inc(amount)
+
+    def enqueue(self, to_email, subject, body):
+        now = int(time.time())
+        with self.store.transaction() as cursor:
+            cursor.execute('SELECT 1 FROM email_outbox WHERE to_email = ? AND subject = ? AND body = ? AND created >= ? LIMIT 1',
+                           (to_email, subject, body, now - self.dedupe_window))
+            queued = cursor.fetchone() is None
+            if queued:
+                cursor.execute('INSERT INTO email_outbox (to_email, subject, body, created, next_attempt) VALUES (?, ?, ?, ?, ?)',
+                               (to_email, subject, body, now, now))
+        self._count('queued' if queued else 'deduplicated')
+        if queued:
+            self.wake.set()
+        return queued
+
+    def due(self):
+        return self.store._fetchall_dicts("SELECT * FROM email_outbox WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                                          (int(time.time()), self.batch_size))
+
+    def prune(self, max_age, now=None):
+        cutoff = int(now or time.time()) - max_age
+        return self.store._execute("DELETE FROM email_outbox WHERE status != 'pending' AND created < ?", (cutoff,))
+
+    def _mark_sent(self, ids):
+        with self.store.transaction() as cursor:
+            cursor.executemany("UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL WHERE id = ?",
+                               [(email_id,) for email_id in ids])
+        self._count('sent', len(ids))
+
+    def _fail(self, message, error):
+        self.store._execute("UPDATE email_outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?", (error, message['id']))
+        self._count('failed')
+        logger.error(f"Giving up on email {message['id']} to {message['to_email']}: {error}")
+
+    def _retry(self, message, error):
+        if message['attempts'] + 1 >= self.max_attempts:
+            self._fail(message, error)
+            return
+        next_attempt = time.time() + self.retry_base * 2 ** message['attempts']
+        self.store._execute('UPDATE email_outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE id = ?',
+                            (int(next_attempt), error, message['id']))
+        self._count('retried')
+
+    def _connect(self):
+        server = smtplib.SMTP(*self.smtp, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.password:
+                server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+    def _session(self):
+        if self.server is not None:
+            try:
+                if self.server.noop()[0] == 250:
+                    return self.server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close()
+        self.server = self._connect()
+        return self.server
+
+    def flush(self):
+        messages = self.due()
+        if not messages:
+            if self.server is not None and time.time() - self.last_used > self.idle_timeout:
+                self._close()
+            return 0
+        try:
+            server = self._session()
+        except (smtplib.SMTPException, OSError) as e:
+            self._close()
+            for message in messages:
+                self._retry(message, str(e))
+            return 0
+        sent = []
+        try:
+            for message in messages:
+                msg = MIMEText(message['body'])
+                msg['Subject'] = message['subject']
+                msg['From'] = self.user
+                msg['To'] = message['to_email']
+                try:
+                    server.sendmail(self.user, message['to_email'], msg.as_string())
+                    sent.append(message['id'])
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    code = getattr(e, 'smtp_code', None) or min((c for c, _ in e.recipients.values()), default=0)
+                    if code >= 500:
+                        self._fail(message, str(e))
+                    else:
+                        self._retry(message, str(e))
+                except (smtplib.SMTPException, OSError) as e:
+                    self._close()
+                    self._retry(message, str(e))
+                    try:
+                        server = self.server = self._connect()
+                    except (smtplib.SMTPException, OSError):
+                        break
+        finally:
+            if sent:
+                self._mark_sent(sent)
+            self.last_used = time.time()
+        if len(sent) == len(messages) == self.batch_size:
+            self.wake.set()
+        return len(sent)
+
+    def stop(self):
+        super().stop()
+        self._close()
@@ -0,0 +1,41 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger('HVMPanel')
+
+class PeriodicFlusher(ABC):
+    def __init__(self, flush_interval, name):
+        self.flush_interval = flush_interval
+        self.name = name
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    @abstractmethod
+    def flush(self):
+        pass
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"{self.name} flush error: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"{self.name} flush error: {e}")
@@ -3,7 +3,7 @@ import sys
 import subprocess
 import requests
 import flask
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, session, g, has_request_context, Response, stream_with_context
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import docker
@@ -30,21 +30,29 @@ import tty
 import fcntl
 import struct
 import signal
+import atexit
 import uuid
 import concurrent.futures
 import csv
+import gzip
 import io
 from werkzeug.utils import secure_filename
 import tarfile
 from io import BytesIO
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-import smtplib
-from email.mime.text import MIMEText
-from collections import deque
 import shlex
+import heapq
+import re
+from urllib.parse import urlsplit
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 import base64
 from ecdsa import VerifyingKey, BadSignatureError, NIST384p
+from resource_ring import ResourceRing
+from cgroups import CgroupReader
+from sqlite_store import SQLiteStore
+from flusher import PeriodicFlusher
+from email_outbox import EmailOutbox
 
 PUBLIC_HEX = 'b681f4f051055d844c3f21678db26759adacf292fc649b49e08800b316173927aa08df82ad4a9a9930e26315ddc8531671ba42cdf16e91c086ce30150b6470cb37f390da3b3ec6522bed24cb1703efff9a0c8ec8d744222657e1944f5a08d81e'
 
@@ -109,7 +117,14 @@ DEFAULT_OS_IMAGE = os.getenv('DEFAULT_OS_IMAGE', 'ubuntu:22.04')
 DOCKER_NETWORK = os.getenv('DOCKER_NETWORK', 'hvm_network')
 MAX_CONTAINERS = int(os.getenv('MAX_CONTAINERS', '100'))
 DB_FILE = 'hvm_panel.db'
-BACKUP_FILE = 'hvm_panel_backup.json'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+HOST_CPUS = os.cpu_count() or 1
+BACKUP_FILE = 'hvm_panel_backup.ndjson.gz'
+BACKUP_TABLES = [
+    'users', 'vps_instances', 'usage_stats', 'system_settings', 'banned_users', 'docker_images',
+    'notifications', 'audit_logs', 'vps_templates', 'resource_history', 'resource_history_rollup',
+    'vps_groups', 'vps_group_assignments', 'support_tickets', 'referrals', 'licenses'
+]
 SERVER_IP = os.getenv('SERVER_IP', socket.gethostbyname(socket.gethostname()))
 SERVER_PORT = int(os.getenv('SERVER_PORT', '3000'))
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
@@ -120,14 +135,59 @@ SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
 SMTP_USER = os.getenv('SMTP_USER', 'user@example.com')
 SMTP_PASS = os.getenv('SMTP_PASS', 'password')
 NOTIFICATION_EMAIL = os.getenv('NOTIFICATION_EMAIL', 'admin@example.com')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'True').lower() == 'true'
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '10'))
+EMAIL_FLUSH_INTERVAL = float(os.getenv('EMAIL_FLUSH_INTERVAL', '10'))
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', '50'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '6'))
+EMAIL_RETRY_BASE = float(os.getenv('EMAIL_RETRY_BASE', '60'))
+EMAIL_DEDUPE_WINDOW = int(os.getenv('EMAIL_DEDUPE_WINDOW', '3600'))
+EMAIL_IDLE_TIMEOUT = float(os.getenv('EMAIL_IDLE_TIMEOUT', '60'))
+EMAIL_RETENTION_DAYS = int(os.getenv('EMAIL_RETENTION_DAYS', '7'))
 BACKUP_SCHEDULE = os.getenv('BACKUP_SCHEDULE', 'daily')
 VPS_HOSTNAME_PREFIX = os.getenv('VPS_HOSTNAME_PREFIX', 'hvm-')
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '30'))
+HISTORY_FLUSH_ROWS = int(os.getenv('HISTORY_FLUSH_ROWS', '500'))
+HISTORY_SAMPLE_INTERVAL = 5
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', '15'))
+STATS_COLLECTOR_WORKERS = int(os.getenv('STATS_COLLECTOR_WORKERS', '16'))
+STATS_COLLECTOR_TIMEOUT = float(os.getenv('STATS_COLLECTOR_TIMEOUT', '4'))
+STATS_HUB_MAX_AGE = 10
+CGROUP_ROOT = os.getenv('CGROUP_ROOT', '/sys/fs/cgroup')
+DOCKER_VOLUME_PATH = '/var/lib/docker/volumes/hvm-{vps_id}/_data'
+DISK_ACCOUNTING_INTERVAL = float(os.getenv('DISK_ACCOUNTING_INTERVAL', '300'))
+DISK_SCAN_BUDGET = float(os.getenv('DISK_SCAN_BUDGET', '10'))
+DISK_QUOTA_WARN_PERCENT = float(os.getenv('DISK_QUOTA_WARN_PERCENT', '90'))
+CONTAINER_RESYNC_INTERVAL = float(os.getenv('CONTAINER_RESYNC_INTERVAL', '300'))
+EXPIRY_WARNING_LEADS = tuple(int(lead) for lead in os.getenv('EXPIRY_WARNING_LEADS', '86400,3600').split(',') if lead.strip())
+SYSTEM_INFO_TTL = float(os.getenv('SYSTEM_INFO_TTL', '60'))
+LIVE_STATS_INTERVAL = float(os.getenv('LIVE_STATS_INTERVAL', '5'))
+LIVE_STATS_KEYFRAME_EVERY = 60
+RESOURCE_RING_SIZE = 3600
+LIVE_HISTORY_POINTS = 120
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+HISTORY_RAW_RETENTION_HOURS = float(os.getenv('HISTORY_RAW_RETENTION_HOURS', '6'))
+HISTORY_ROLLUP_TIERS = (
+    (60, 2 * 86400),
+    (900, 14 * 86400),
+    (3600, 365 * 86400)
+)
 
 MINER_PATTERNS = [
     'xmrig', 'ethminer', 'cgminer', 'sgminer', 'bfgminer',
     'minerd', 'cpuminer', 'cryptonight', 'stratum', 'nicehash', 'miner',
     'xmr-stak', 'ccminer', 'ewbf', 'lolminer', 'trex', 'nanominer'
 ]
+MINER_REGEX = re.compile('|'.join(re.escape(pattern) for pattern in MINER_PATTERNS), re.IGNORECASE)
+ANTI_MINER_WORKERS = int(os.getenv('ANTI_MINER_WORKERS', '4'))
+ANTI_MINER_CPU_BUDGET = float(os.getenv('ANTI_MINER_CPU_BUDGET', '0.05'))
+STRATUM_PORTS = {3333, 3334, 3357, 5556, 14433, 14444, 45560, 45700}
+ABUSE_CPU_THRESHOLD = float(os.getenv('ABUSE_CPU_THRESHOLD', '90'))
+ABUSE_SUSTAINED_SECONDS = int(os.getenv('ABUSE_SUSTAINED_SECONDS', '600'))
+ABUSE_SUSTAINED_FRACTION = 0.9
+ABUSE_EWMA_ALPHA = 0.1
+ABUSE_SUSPEND_SCORE = float(os.getenv('ABUSE_SUSPEND_SCORE', '0.6'))
+ABUSE_WEIGHTS = {'process': 0.6, 'stratum': 0.4, 'sustained_cpu': 0.3, 'ewma_cpu': 0.2}
 
 DOCKERFILE_TEMPLATE = """
 FROM {base_image}
@@ -152,6 +212,23 @@ STOPSIGNAL SIGRTMIN+3
 CMD ["/sbin/init"]
 """
 
+REQUEST_SECONDS = Histogram('hvm_http_request_duration_seconds', 'Flask request latency', ['endpoint', 'method'])
+DB_LOCK_WAIT_SECONDS = Histogram('hvm_db_lock_wait_seconds', 'Time spent waiting for the database write lock',
+                                 buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+DB_QUERY_SECONDS = Histogram('hvm_db_query_duration_seconds', 'Database statement time', ['kind'],
+                             buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+DOCKER_API_SECONDS = Histogram('hvm_docker_api_duration_seconds', 'Docker SDK call latency', ['operation'])
+DOCKER_EXEC_TOTAL = Counter('hvm_docker_exec_total', 'docker exec subprocesses run', ['result'])
+DOCKER_EXEC_SECONDS = Histogram('hvm_docker_exec_duration_seconds', 'docker exec subprocess duration',
+                                buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0))
+LOOP_SECONDS = Histogram('hvm_background_loop_duration_seconds', 'Background loop cycle duration', ['loop'],
+                         buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+JOB_FAILURES = Counter('hvm_scheduler_job_failures_total', 'Scheduled job runs that raised', ['job'])
+JOB_SKIPPED = Counter('hvm_scheduler_job_skipped_total', 'Scheduled job runs skipped because the previous run was still going', ['job'])
+SOCKETIO_SESSIONS = Gauge('hvm_socketio_sessions', 'Connected Socket.IO clients', ['namespace'])
+SHELL_SESSIONS = Gauge('hvm_shell_sessions', 'Open SSH and console sessions', ['kind'])
+EMAIL_OUTBOX_TOTAL = Counter('hvm_email_outbox_total', 'Outbox messages by outcome', ['result'])
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -171,43 +248,22 @@ class User(UserMixin):
         self.email = email
         self.theme = theme
 
-class Database:
-    def __init__(self, db_file):
-        self.db_file = db_file
-        self.lock = threading.Lock()
-        self.conn = None
-        self.cursor = None
-        self._connect()
+class Database(SQLiteStore):
+    def __init__(self, db_file, busy_timeout=5.0, pool_size=DB_POOL_SIZE):
+        super().__init__(db_file, busy_timeout, pool_size)
+        self._settings = {}
         self._create_tables()
         self._initialize_settings()
         self._migrate_database()
+        self._load_settings()
 
-    def _connect(self):
-        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+    def _record_lock_wait(self, elapsed):
+        DB_LOCK_WAIT_SECONDS.observe(elapsed)
+        super()._record_lock_wait(elapsed)
 
-    def _execute(self, query, params=()):
-        with self.lock:
-            try:
-                self.cursor.execute(query, params)
-                self.conn.commit()
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e):
-                    time.sleep(0.1)
-                    self.cursor.execute(query, params)
-                    self.conn.commit()
-                else:
-                    raise
-
-    def _fetchone(self, query, params=()):
-        with self.lock:
-            self.cursor.execute(query, params)
-            return self.cursor.fetchone()
-
-    def _fetchall(self, query, params=()):
-        with self.lock:
-            self.cursor.execute(query, params)
-            return self.cursor.fetchall()
+    def _record_query(self, kind, elapsed):
+        DB_QUERY_SECONDS.labels(kind).observe(elapsed)
+        super()._record_query(kind, elapsed)
 
     def _create_tables(self):
         self._execute('''
@@ -328,11 +384,32 @@ class Database:
                 disk_usage REAL,
                 bandwidth_in REAL,
                 bandwidth_out REAL,
-                timestamp TEXT,
+                timestamp INTEGER,
                 FOREIGN KEY (vps_id) REFERENCES vps_instances (vps_id) ON DELETE CASCADE
             )
         ''')
 
+        self._execute('''
+            CREATE TABLE IF NOT EXISTS resource_history_rollup (
+                vps_id TEXT,
+                resolution INTEGER,
+                bucket INTEGER,
+                samples INTEGER,
+                cpu_min REAL,
+                cpu_avg REAL,
+                cpu_max REAL,
+                memory_min REAL,
+                memory_avg REAL,
+                memory_max REAL,
+                disk_min REAL,
+                disk_avg REAL,
+                disk_max REAL,
+                bandwidth_in REAL,
+                bandwidth_out REAL,
+                PRIMARY KEY (vps_id, resolution, bucket)
+            )
+        ''')
+
         self._execute('''
             CREATE TABLE IF NOT EXISTS vps_groups (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -416,6 +493,46 @@ class Database:
         if 'reason' not in banned_columns:
             self._execute('ALTER TABLE banned_users ADD COLUMN reason TEXT DEFAULT "No reason provided"')
 
+        history_columns = {col[1]: col[2] for col in self._fetchall("PRAGMA table_info(resource_history)")}
+        if history_columns.get('timestamp') != 'INTEGER':
+            self._migrate_resource_history_timestamps()
+
+        self._execute('CREATE INDEX IF NOT EXISTS idx_resource_history_vps_ts ON resource_history (vps_id, timestamp)')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_resource_history_ts ON resource_history (timestamp)')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp ON audit_logs (timestamp)')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications (user_id, created_at)')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_vps_instances_created_by ON vps_instances (created_by)')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_vps_instances_container ON vps_instances (container_id)')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_resource_history_rollup_bucket ON resource_history_rollup (resolution, bucket)')
+        self._execute('PRAGMA optimize')
+        self._column_cache.clear()
+
+    def _migrate_resource_history_timestamps(self):
+        logger.info("Migrating resource_history timestamps to epoch integers")
+        with self.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE resource_history_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    vps_id TEXT,
+                    cpu_percent REAL,
+                    memory_percent REAL,
+                    disk_usage REAL,
+                    bandwidth_in REAL,
+                    bandwidth_out REAL,
+                    timestamp INTEGER,
+                    FOREIGN KEY (vps_id) REFERENCES vps_instances (vps_id) ON DELETE CASCADE
+                )
+            ''')
+            cursor.execute('''
+                INSERT INTO resource_history_new (id, vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, timestamp)
+                SELECT id, vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out,
+                       CASE WHEN typeof(timestamp) = 'text' THEN CAST(strftime('%s', substr(timestamp, 1, 19), 'utc') AS INTEGER)
+                            ELSE timestamp END
+                FROM resource_history
+            ''')
+            cursor.execute('DROP TABLE resource_history')
+            cursor.execute('ALTER TABLE resource_history_new RENAME TO resource_history')
+
     def _initialize_settings(self):
         defaults = {
             'max_containers': str(MAX_CONTAINERS),
@@ -437,34 +554,30 @@ class Database:
             self._execute('INSERT INTO users (username, password, role, created_at) VALUES (?, ?, ?, ?)',
                           (ADMIN_USERNAME, hashed, 'admin', str(datetime.datetime.now())))
 
+    def _load_settings(self):
+        self._settings = {row[0]: row[1] for row in self._fetchall('SELECT key, value FROM system_settings')}
+
     def get_setting(self, key, default=None):
-        result = self._fetchone('SELECT value FROM system_settings WHERE key = ?', (key,))
-        return result[0] if result else default
+        return self._settings.get(key, default)
 
     def set_setting(self, key, value):
-        self._execute('INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)', (key, str(value)))
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO system_settings (key, value) VALUES (?, ?)', (key, str(value)))
+        self._settings[key] = str(value)
 
     def get_stat(self, key, default=0):
         result = self._fetchone('SELECT value FROM usage_stats WHERE key = ?', (key,))
         return result[0] if result else default
 
-    def increment_stat(self, key, amount=1):
-        current = self.get_stat(key)
-        self._execute('INSERT OR REPLACE INTO usage_stats (key, value) VALUES (?, ?)', (key, current + amount))
+    def increment_stats(self, amounts):
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT INTO usage_stats (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = value + excluded.value', amounts.items())
 
     def get_user(self, username):
-        row = self._fetchone('SELECT * FROM users WHERE username = ?', (username,))
-        if row:
-            columns = [desc[0] for desc in self.cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return self._fetchone_dict('SELECT * FROM users WHERE username = ?', (username,))
 
     def get_user_by_id(self, user_id):
-        row = self._fetchone('SELECT * FROM users WHERE id = ?', (user_id,))
-        if row:
-            columns = [desc[0] for desc in self.cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return self._fetchone_dict('SELECT * FROM users WHERE id = ?', (user_id,))
 
     def create_user(self, username, password, role='user', email=None, theme='light'):
         try:
@@ -485,41 +598,32 @@ class Database:
         if not updates: return False
         set_clause = ', '.join(f'{k} = ?' for k in updates)
         values = list(updates.values()) + [user_id]
-        self._execute(f'UPDATE users SET {set_clause} WHERE id = ?', values)
-        return self.cursor.rowcount > 0
+        return self._execute(f'UPDATE users SET {set_clause} WHERE id = ?', values) > 0
 
     def delete_user(self, user_id):
-        self._execute('DELETE FROM users WHERE id = ?', (user_id,))
-        return self.cursor.rowcount > 0
+        return self._execute('DELETE FROM users WHERE id = ?', (user_id,)) > 0
 
     def get_vps_by_id(self, vps_id):
-        row = self._fetchone('SELECT * FROM vps_instances WHERE vps_id = ?', (vps_id,))
-        if row:
-            columns = [desc[0] for desc in self.cursor.description]
-            vps = dict(zip(columns, row))
+        vps = self._fetchone_dict('SELECT * FROM vps_instances WHERE vps_id = ?', (vps_id,))
+        if vps:
             return vps['token'], vps
         return None, None
 
+    def get_vps_by_container(self, container_id):
+        return self._fetchone_dict('SELECT * FROM vps_instances WHERE container_id = ?', (container_id,))
+
     def get_vps_by_token(self, token):
-        row = self._fetchone('SELECT * FROM vps_instances WHERE token = ?', (token,))
-        if row:
-            columns = [desc[0] for desc in self.cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return self._fetchone_dict('SELECT * FROM vps_instances WHERE token = ?', (token,))
 
     def get_user_vps_count(self, user_id):
         result = self._fetchone('SELECT COUNT(*) FROM vps_instances WHERE created_by = ?', (user_id,))
         return result[0] if result else 0
 
     def get_user_vps(self, user_id):
-        rows = self._fetchall('SELECT * FROM vps_instances WHERE created_by = ?', (user_id,))
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return self._fetchall_dicts('SELECT * FROM vps_instances WHERE created_by = ?', (user_id,))
 
     def get_all_vps(self):
-        rows = self._fetchall('SELECT * FROM vps_instances')
-        columns = [desc[0] for desc in self.cursor.description]
-        return {row[1]: dict(zip(columns, row)) for row in rows}
+        return {vps['vps_id']: vps for vps in self._fetchall_dicts('SELECT * FROM vps_instances')}
 
     def add_vps(self, vps_data):
         try:
@@ -527,22 +631,26 @@ class Database:
             placeholders = ', '.join('?' for _ in vps_data)
             sql = f'INSERT INTO vps_instances ({", ".join(columns)}) VALUES ({placeholders})'
             self._execute(sql, tuple(vps_data.values()))
-            self.increment_stat('total_vps_created')
             return True
         except sqlite3.Error as e:
             logger.error(f"Error adding VPS: {e}")
             return False
 
     def remove_vps(self, token):
-        self._execute('DELETE FROM vps_instances WHERE token = ?', (token,))
-        return self.cursor.rowcount > 0
+        return self._execute('DELETE FROM vps_instances WHERE token = ?', (token,)) > 0
+
+    def sync_vps_status(self, token, status, protected=()):
+        # Conditional so a container event racing a panel action (suspend,
+        # expiry) cannot overwrite the panel's state with 'exited'.
+        placeholders = ', '.join('?' for _ in protected) or "''"
+        return self._execute(f"UPDATE vps_instances SET status = ? WHERE token = ? AND status != ? AND (? = 'running' OR status NOT IN ({placeholders}))",
+                             (status, token, status, status, *protected)) > 0
 
     def update_vps(self, token, updates):
         try:
             set_clause = ', '.join(f'{k} = ?' for k in updates)
             values = list(updates.values()) + [token]
-            self._execute(f'UPDATE vps_instances SET {set_clause} WHERE token = ?', values)
-            return self.cursor.rowcount > 0
+            return self._execute(f'UPDATE vps_instances SET {set_clause} WHERE token = ?', values) > 0
         except sqlite3.Error as e:
             logger.error(f"Error updating VPS: {e}")
             return False
@@ -565,20 +673,13 @@ class Database:
         return [(row[0], row[1]) for row in rows]
 
     def get_all_users(self):
-        rows = self._fetchall('SELECT id, username, role, created_at, email, theme FROM users')
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return self._fetchall_dicts('SELECT id, username, role, created_at, email, theme FROM users')
 
     def update_user_role(self, user_id, role):
-        self._execute('UPDATE users SET role = ? WHERE id = ?', (role, user_id))
-        return self.cursor.rowcount > 0
+        return self._execute('UPDATE users SET role = ? WHERE id = ?', (role, user_id)) > 0
 
     def get_image(self, os_image):
-        row = self._fetchone('SELECT * FROM docker_images WHERE os_image = ?', (os_image,))
-        if row:
-            columns = [desc[0] for desc in self.cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return self._fetchone_dict('SELECT * FROM docker_images WHERE os_image = ?', (os_image,))
 
     def add_image(self, image_data):
         columns = ', '.join(image_data.keys())
@@ -590,9 +691,7 @@ class Database:
                       (user_id, message, str(datetime.datetime.now())))
 
     def get_notifications(self, user_id):
-        rows = self._fetchall('SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return self._fetchall_dicts('SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
 
     def mark_notification_read(self, notif_id):
         self._execute('UPDATE notifications SET read = TRUE WHERE id = ?', (notif_id,))
@@ -602,38 +701,99 @@ class Database:
                       (user_id, action, details, str(datetime.datetime.now())))
 
     def get_audit_logs(self, limit=100):
-        rows = self._fetchall('SELECT * FROM audit_logs ORDER BY timestamp DESC LIMIT ?', (limit,))
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
-
-    def add_resource_history(self, vps_id, cpu, mem, disk, band_in, band_out):
-        self._execute('INSERT INTO resource_history (vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                      (vps_id, cpu, mem, disk, band_in, band_out, str(datetime.datetime.now())))
-
-    def get_resource_history(self, vps_id, limit=100):
-        rows = self._fetchall('SELECT * FROM resource_history WHERE vps_id = ? ORDER BY timestamp DESC LIMIT ?', (vps_id, limit))
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return self._fetchall_dicts('SELECT * FROM audit_logs ORDER BY timestamp DESC LIMIT ?', (limit,))
+
+    def add_resource_history_batch(self, rows):
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT INTO resource_history (vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def rollup_resource_history(self, now=None):
+        settled = int(now or time.time()) - int(HISTORY_FLUSH_INTERVAL) - HISTORY_SAMPLE_INTERVAL
+        source_resolution = None
+        for resolution, _ in HISTORY_ROLLUP_TIERS:
+            end = settled - settled % resolution
+            row = self._fetchone('SELECT MAX(bucket) FROM resource_history_rollup WHERE resolution = ?', (resolution,))
+            start = row[0] if row and row[0] is not None else 0
+            with self.transaction() as cursor:
+                if source_resolution is None:
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO resource_history_rollup
+                            (vps_id, resolution, bucket, samples, cpu_min, cpu_avg, cpu_max, memory_min, memory_avg, memory_max,
+                             disk_min, disk_avg, disk_max, bandwidth_in, bandwidth_out)
+                        SELECT vps_id, ?, timestamp / ? * ?, COUNT(*),
+                               MIN(cpu_percent), AVG(cpu_percent), MAX(cpu_percent),
+                               MIN(memory_percent), AVG(memory_percent), MAX(memory_percent),
+                               MIN(disk_usage), AVG(disk_usage), MAX(disk_usage),
+                               MAX(bandwidth_in), MAX(bandwidth_out)
+                        FROM resource_history
+                        WHERE timestamp >= ? AND timestamp < ?
+                        GROUP BY vps_id, timestamp / ?
+                    ''', (resolution, resolution, resolution, start, end, resolution))
+                else:
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO resource_history_rollup
+                            (vps_id, resolution, bucket, samples, cpu_min, cpu_avg, cpu_max, memory_min, memory_avg, memory_max,
+                             disk_min, disk_avg, disk_max, bandwidth_in, bandwidth_out)
+                        SELECT vps_id, ?, bucket / ? * ?, SUM(samples),
+                               MIN(cpu_min), SUM(cpu_avg * samples) / SUM(samples), MAX(cpu_max),
+                               MIN(memory_min), SUM(memory_avg * samples) / SUM(samples), MAX(memory_max),
+                               MIN(disk_min), SUM(disk_avg * samples) / SUM(samples), MAX(disk_max),
+                               MAX(bandwidth_in), MAX(bandwidth_out)
+                        FROM resource_history_rollup
+                        WHERE resolution = ? AND bucket >= ? AND bucket < ?
+                        GROUP BY vps_id, bucket / ?
+                    ''', (resolution, resolution, resolution, source_resolution, start, end, resolution))
+            source_resolution = resolution
+
+    def prune_resource_history(self, now=None, batch_size=5000):
+        now = int(now or time.time())
+        cutoff = now - int(HISTORY_RAW_RETENTION_HOURS * 3600)
+        pruned = 0
+        while True:
+            deleted = self._execute('DELETE FROM resource_history WHERE id IN (SELECT id FROM resource_history WHERE timestamp < ? LIMIT ?)', (cutoff, batch_size))
+            pruned += deleted
+            if deleted < batch_size:
+                break
+        for resolution, retention in HISTORY_ROLLUP_TIERS:
+            pruned += self._execute('DELETE FROM resource_history_rollup WHERE resolution = ? AND bucket < ?', (resolution, now - retention))
+        return pruned
+
+    def get_resource_history_range(self, vps_id, start, end, max_points=360):
+        now = time.time()
+        span = max(end - start, 1)
+        if span / HISTORY_SAMPLE_INTERVAL <= max_points and start >= now - HISTORY_RAW_RETENTION_HOURS * 3600:
+            rows = self._fetchall_dicts('''
+                SELECT timestamp, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out
+                FROM resource_history WHERE vps_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp
+            ''', (vps_id, int(start), int(end)))
+            return HISTORY_SAMPLE_INTERVAL, rows
+        resolution = HISTORY_ROLLUP_TIERS[-1][0]
+        for tier_resolution, retention in HISTORY_ROLLUP_TIERS:
+            if span / tier_resolution <= max_points and start >= now - retention:
+                resolution = tier_resolution
+                break
+        rows = self._fetchall_dicts('''
+            SELECT bucket AS timestamp, cpu_avg AS cpu_percent, memory_avg AS memory_percent, disk_avg AS disk_usage,
+                   bandwidth_in, bandwidth_out, cpu_min, cpu_max, memory_min, memory_max, disk_min, disk_max, samples
+            FROM resource_history_rollup WHERE vps_id = ? AND resolution = ? AND bucket >= ? AND bucket < ? ORDER BY bucket
+        ''', (vps_id, resolution, int(start), int(end)))
+        return resolution, rows
 
     def add_group(self, name, desc):
         self._execute('INSERT INTO vps_groups (name, description) VALUES (?, ?)', (name, desc))
 
     def get_groups(self):
-        rows = self._fetchall('SELECT * FROM vps_groups')
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return self._fetchall_dicts('SELECT * FROM vps_groups')
 
     def assign_vps_to_group(self, group_id, vps_id):
         self._execute('INSERT OR IGNORE INTO vps_group_assignments (group_id, vps_id) VALUES (?, ?)', (group_id, vps_id))
 
     def get_vps_groups(self, vps_id):
-        rows = self._fetchall('''
+        return self._fetchall_dicts('''
             SELECT g.* FROM vps_groups g
             JOIN vps_group_assignments ga ON g.id = ga.group_id
             WHERE ga.vps_id = ?
         ''', (vps_id,))
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
 
     def generate_referral_code(self, user_id):
         code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
@@ -647,138 +807,178 @@ class Database:
     def increment_referred(self, user_id):
         self._execute('UPDATE referrals SET referred_users = referred_users + 1 WHERE user_id = ?', (user_id,))
 
-    def backup_data(self):
-        data = {
-            'users': self.get_all_users(),
-            'vps_instances': list(self.get_all_vps().values()),
-            'usage_stats': {row[0]: row[1] for row in self._fetchall('SELECT * FROM usage_stats')},
-            'system_settings': {row[0]: row[1] for row in self._fetchall('SELECT * FROM system_settings')},
-            'banned_users': [(row[0], row[1]) for row in self._fetchall('SELECT * FROM banned_users')],
-            'docker_images': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM docker_images')],
-            'notifications': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM notifications')],
-            'audit_logs': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM audit_logs')],
-            'vps_templates': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM vps_templates')],
-            'resource_history': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM resource_history')],
-            'vps_groups': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM vps_groups')],
-            'vps_group_assignments': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM vps_group_assignments')],
-            'support_tickets': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM support_tickets')],
-            'referrals': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM referrals')],
-            'licenses': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM licenses')]
-        }
-        with open(BACKUP_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-        return True
+    def _iter_backup_lines(self, batch_size=1000):
+        conn = sqlite3.connect(self.db_file, timeout=self.busy_timeout)
+        try:
+            conn.execute('BEGIN')
+            yield json.dumps({'format': 'hvm-backup', 'version': 1, 'created_at': str(datetime.datetime.now())}) + '\n'
+            for table in BACKUP_TABLES:
+                cursor = conn.execute(f'SELECT * FROM {table}')
+                yield json.dumps({'table': table, 'columns': [desc[0] for desc in cursor.description]}) + '\n'
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield ''.join(json.dumps(row) + '\n' for row in rows)
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def iter_backup(self, chunk_size=65536):
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as archive:
+            for lines in self._iter_backup_lines():
+                archive.write(lines.encode('utf-8'))
+                if buffer.tell() >= chunk_size:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+
+    def backup_data(self, path=BACKUP_FILE):
+        temp_path = f'{path}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in self.iter_backup():
+                    f.write(chunk)
+            os.replace(temp_path, path)
+            return True
+        except Exception as e:
+            logger.error(f"Backup error: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
 
-    def restore_data(self):
-        if not os.path.exists(BACKUP_FILE):
+    def _open_backup(self, path):
+        with open(path, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        return gzip.open(path, 'rt', encoding='utf-8') if compressed else open(path, 'r', encoding='utf-8')
+
+    def _is_stream_backup(self, f):
+        first = f.readline()
+        f.seek(0)
+        try:
+            return json.loads(first).get('format') == 'hvm-backup'
+        except (ValueError, AttributeError):
             return False
-       
-        with open(BACKUP_FILE, 'r') as f:
-            data = json.load(f)
-       
+
+    def _normalize_legacy_backup(self, data):
+        tables = {}
+        for table in BACKUP_TABLES:
+            rows = data.get(table, [])
+            if table == 'usage_stats' or table == 'system_settings':
+                rows = [{'key': k, 'value': v} for k, v in rows.items()]
+            elif table == 'banned_users':
+                rows = [{'user_id': uid, 'reason': reason} for uid, reason in rows]
+            elif table == 'users':
+                for user in rows:
+                    user.setdefault('password', generate_password_hash('default'))
+                    user.setdefault('theme', 'light')
+            elif table == 'vps_instances':
+                for vps in rows:
+                    vps.setdefault('additional_ports', '')
+                    vps.setdefault('bandwidth_limit', 0)
+                    vps.setdefault('tags', '')
+            elif table == 'resource_history':
+                for hist in rows:
+                    if isinstance(hist.get('timestamp'), str):
+                        hist['timestamp'] = int(datetime.datetime.fromisoformat(hist['timestamp']).timestamp())
+            columns = list(dict.fromkeys(key for row in rows for key in row))
+            tables[table] = (columns, [tuple(row.get(c) for c in columns) for row in rows])
+        return tables
+
+    def _iter_backup(self, path, batch_size=5000):
+        with self._open_backup(path) as f:
+            if not self._is_stream_backup(f):
+                for table, (columns, rows) in self._normalize_legacy_backup(json.load(f)).items():
+                    for i in range(0, max(len(rows), 1), batch_size):
+                        yield table, columns, rows[i:i + batch_size]
+                return
+            f.readline()
+            table = columns = None
+            batch = []
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    if table is not None:
+                        yield table, columns, batch
+                    table, columns, batch = record['table'], record['columns'], []
+                else:
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        yield table, columns, batch
+                        batch = []
+            if table is not None:
+                yield table, columns, batch
+
+    def _scan_backup(self, path):
+        manifest = {}
+        with self._open_backup(path) as f:
+            if not self._is_stream_backup(f):
+                legacy = self._normalize_legacy_backup(json.load(f))
+                return {table: (columns, len(rows)) for table, (columns, rows) in legacy.items()}
+            f.readline()
+            table = None
+            for line in f:
+                if line.startswith('{'):
+                    record = json.loads(line)
+                    table = record['table']
+                    manifest[table] = (record['columns'], 0)
+                elif table is not None and line.strip():
+                    columns, count = manifest[table]
+                    manifest[table] = (columns, count + 1)
+        return manifest
+
+    def _validate_backup(self, manifest):
+        for table, (columns, _) in manifest.items():
+            if table not in BACKUP_TABLES:
+                raise ValueError(f"Unknown table in backup: {table}")
+            known = {col[1] for col in self._fetchall(f'PRAGMA table_info({table})')}
+            unknown = [c for c in columns if c not in known]
+            if unknown:
+                raise ValueError(f"Unknown columns in backup table {table}: {', '.join(unknown)}")
+
+    def restore_data(self, path=BACKUP_FILE, progress=None):
+        if not os.path.exists(path):
+            return False
+
+        started = time.perf_counter()
+        restored = 0
         try:
-            self._execute('DELETE FROM users')
-            for user in data.get('users', []):
-                hashed = user.get('password', generate_password_hash('default'))
-                self._execute('INSERT INTO users (id, username, password, role, email, created_at, theme) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                              (user['id'], user['username'], hashed, user['role'], user.get('email'), user['created_at'], user.get('theme', 'light')))
-           
-            self._execute('DELETE FROM vps_instances')
-            for vps in data.get('vps_instances', []):
-                vps['additional_ports'] = vps.get('additional_ports', '')
-                vps['bandwidth_limit'] = vps.get('bandwidth_limit', 0)
-                vps['tags'] = vps.get('tags', '')
-                columns = ', '.join(vps.keys())
-                placeholders = ', '.join('?' for _ in vps)
-                self._execute(f'INSERT INTO vps_instances ({columns}) VALUES ({placeholders})', tuple(vps.values()))
-           
-            self._execute('DELETE FROM usage_stats')
-            for k, v in data.get('usage_stats', {}).items():
-                self._execute('INSERT INTO usage_stats (key, value) VALUES (?, ?)', (k, v))
-           
-            self._execute('DELETE FROM system_settings')
-            for k, v in data.get('system_settings', {}).items():
-                self._execute('INSERT INTO system_settings (key, value) VALUES (?, ?)', (k, v))
-           
-            self._execute('DELETE FROM banned_users')
-            for uid, reason in data.get('banned_users', []):
-                self._execute('INSERT INTO banned_users (user_id, reason) VALUES (?, ?)', (uid, reason))
-           
-            self._execute('DELETE FROM docker_images')
-            for img in data.get('docker_images', []):
-                columns = ', '.join(img.keys())
-                placeholders = ', '.join('?' for _ in img)
-                self._execute(f'INSERT INTO docker_images ({columns}) VALUES ({placeholders})', tuple(img.values()))
-           
-            self._execute('DELETE FROM notifications')
-            for notif in data.get('notifications', []):
-                columns = ', '.join(notif.keys())
-                placeholders = ', '.join('?' for _ in notif)
-                self._execute(f'INSERT INTO notifications ({columns}) VALUES ({placeholders})', tuple(notif.values()))
-           
-            self._execute('DELETE FROM audit_logs')
-            for log in data.get('audit_logs', []):
-                columns = ', '.join(log.keys())
-                placeholders = ', '.join('?' for _ in log)
-                self._execute(f'INSERT INTO audit_logs ({columns}) VALUES ({placeholders})', tuple(log.values()))
-           
-            self._execute('DELETE FROM vps_templates')
-            for temp in data.get('vps_templates', []):
-                columns = ', '.join(temp.keys())
-                placeholders = ', '.join('?' for _ in temp)
-                self._execute(f'INSERT INTO vps_templates ({columns}) VALUES ({placeholders})', tuple(temp.values()))
-           
-            self._execute('DELETE FROM resource_history')
-            for hist in data.get('resource_history', []):
-                columns = ', '.join(hist.keys())
-                placeholders = ', '.join('?' for _ in hist)
-                self._execute(f'INSERT INTO resource_history ({columns}) VALUES ({placeholders})', tuple(hist.values()))
-           
-            self._execute('DELETE FROM vps_groups')
-            for group in data.get('vps_groups', []):
-                columns = ', '.join(group.keys())
-                placeholders = ', '.join('?' for _ in group)
-                self._execute(f'INSERT INTO vps_groups ({columns}) VALUES ({placeholders})', tuple(group.values()))
-           
-            self._execute('DELETE FROM vps_group_assignments')
-            for assign in data.get('vps_group_assignments', []):
-                columns = ', '.join(assign.keys())
-                placeholders = ', '.join('?' for _ in assign)
-                self._execute(f'INSERT INTO vps_group_assignments ({columns}) VALUES ({placeholders})', tuple(assign.values()))
-           
-            self._execute('DELETE FROM support_tickets')
-            for ticket in data.get('support_tickets', []):
-                columns = ', '.join(ticket.keys())
-                placeholders = ', '.join('?' for _ in ticket)
-                self._execute(f'INSERT INTO support_tickets ({columns}) VALUES ({placeholders})', tuple(ticket.values()))
-
-            self._execute('DELETE FROM referrals')
-            for ref in data.get('referrals', []):
-                columns = ', '.join(ref.keys())
-                placeholders = ', '.join('?' for _ in ref)
-                self._execute(f'INSERT INTO referrals ({columns}) VALUES ({placeholders})', tuple(ref.values()))
-
-            self._execute('DELETE FROM licenses')
-            for lic in data.get('licenses', []):
-                columns = ', '.join(lic.keys())
-                placeholders = ', '.join('?' for _ in lic)
-                self._execute(f'INSERT INTO licenses ({columns}) VALUES ({placeholders})', tuple(lic.values()))
-           
-            return True
+            manifest = self._scan_backup(path)
+            self._validate_backup(manifest)
+            total = sum(count for _, count in manifest.values())
+            with self.transaction() as cursor:
+                for table in BACKUP_TABLES:
+                    cursor.execute(f'DELETE FROM {table}')
+                last_report = started
+                for table, columns, rows in self._iter_backup(path):
+                    if not rows:
+                        continue
+                    cursor.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})', rows)
+                    restored += len(rows)
+                    now = time.perf_counter()
+                    if now - last_report >= 1 or restored == total:
+                        last_report = now
+                        rate = restored / max(now - started, 1e-6)
+                        logger.info(f"Restore progress: {restored}/{total} rows ({rate:.0f} rows/s)")
+                        if progress:
+                            progress(restored, total, rate)
+            elapsed = time.perf_counter() - started
+            logger.info(f"Restored {restored} rows in {elapsed:.1f}s")
+            return {'rows': restored, 'seconds': round(elapsed, 2), 'rows_per_second': round(restored / max(elapsed, 1e-6))}
         except Exception as e:
             logger.error(f"Restore error: {e}")
             return False
+        finally:
+            self._load_settings()
 
     def add_license(self, license_key, expires_at):
         created_at = str(datetime.datetime.now())
         self._execute('INSERT OR REPLACE INTO licenses (license_key, created_at, expires_at) VALUES (?, ?, ?)', (license_key, created_at, expires_at))
 
     def get_license(self, license_key):
-        row = self._fetchone('SELECT * FROM licenses WHERE license_key = ?', (license_key,))
-        if row:
-            columns = [desc[0] for desc in self.cursor.description]
-            return dict(zip(columns, row))
-        return None
+        return self._fetchone_dict('SELECT * FROM licenses WHERE license_key = ?', (license_key,))
 
     def deactivate_license(self, license_key):
         self._execute('UPDATE licenses SET active = FALSE WHERE license_key = ?', (license_key,))
@@ -787,17 +987,883 @@ class Database:
         self._execute('DELETE FROM licenses WHERE license_key = ?', (license_key,))
 
     def get_all_licenses(self):
-        rows = self._fetchall('SELECT * FROM licenses')
-        columns = [desc[0] for desc in self.cursor.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return self._fetchall_dicts('SELECT * FROM licenses')
+
+class ResourceHistoryWriter(PeriodicFlusher):
+    def __init__(self, database, flush_interval=HISTORY_FLUSH_INTERVAL, max_rows=HISTORY_FLUSH_ROWS):
+        super().__init__(flush_interval, 'Resource history')
+        self.db = database
+        self.max_rows = max_rows
+        self.rows = []
+
+    def add(self, vps_id, cpu, mem, disk, band_in, band_out):
+        with self.lock:
+            self.rows.append((vps_id, cpu, mem, disk, band_in, band_out, int(time.time())))
+            full = len(self.rows) >= self.max_rows
+        if full:
+            self.wake.set()
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if not rows:
+            return 0
+        try:
+            self.db.add_resource_history_batch(rows)
+        except Exception:
+            with self.lock:
+                self.rows[:0] = rows[-self.max_rows * 10:]
+            raise
+        return len(rows)
+
+class StatCounter(PeriodicFlusher):
+    def __init__(self, database, flush_interval=STATS_FLUSH_INTERVAL):
+        super().__init__(flush_interval, 'Usage stats')
+        self.db = database
+        self.pending = {}
+
+    def increment(self, key, amount=1):
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + amount
+
+    def get(self, key, default=0):
+        with self.lock:
+            pending = self.pending.get(key, 0)
+        return self.db.get_stat(key, default) + pending
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        try:
+            self.db.increment_stats(pending)
+        except Exception:
+            with self.lock:
+                for key, amount in pending.items():
+                    self.pending[key] = self.pending.get(key, 0) + amount
+            raise
+        return len(pending)
+
+class DockerStatsHub:
+    """One long-lived stats stream per running container; readers get the latest sample from memory."""
+
+    def __init__(self, client, max_age=STATS_HUB_MAX_AGE):
+        self.client = client
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.streams = {}
+        self.samples = {}
+
+    @staticmethod
+    def summarize(frame, previous=None):
+        cpu_stats = frame.get('cpu_stats') or {}
+        prev_cpu = (previous or {}).get('cpu_stats') or frame.get('precpu_stats') or {}
+        cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) - prev_cpu.get('cpu_usage', {}).get('total_usage', 0)
+        system_delta = cpu_stats.get('system_cpu_usage', 0) - prev_cpu.get('system_cpu_usage', 0)
+        online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+        if system_delta > 0 and cpu_delta >= 0 and prev_cpu.get('system_cpu_usage'):
+            host_share = cpu_delta / system_delta
+        else:
+            host_share = 0.0
+        mem_stats = frame.get('memory_stats') or {}
+        networks = frame.get('networks') or {}
+        return {
+            'cpu_percent': host_share * online_cpus * 100,
+            'cpu_host_percent': host_share * 100,
+            'online_cpus': online_cpus,
+            'memory_usage': mem_stats.get('usage', 0),
+            'memory_limit': mem_stats.get('limit', 0),
+            'net_rx': sum(iface.get('rx_bytes', 0) for iface in networks.values()),
+            'net_tx': sum(iface.get('tx_bytes', 0) for iface in networks.values()),
+            'read_at': time.time()
+        }
+
+    def watch(self, container_id):
+        with self.lock:
+            if container_id in self.streams or self.client is None:
+                return
+            stop = threading.Event()
+            self.streams[container_id] = stop
+        threading.Thread(target=self._stream, args=(container_id, stop), name=f'stats-{container_id[:12]}', daemon=True).start()
+
+    def unwatch(self, container_id):
+        with self.lock:
+            stop = self.streams.pop(container_id, None)
+            self.samples.pop(container_id, None)
+        if stop:
+            stop.set()
+
+    def sync(self, running_ids):
+        running_ids = set(running_ids)
+        with self.lock:
+            stale = [cid for cid in self.streams if cid not in running_ids]
+        for cid in stale:
+            self.unwatch(cid)
+        for cid in running_ids:
+            self.watch(cid)
+
+    def get(self, container_id):
+        sample = self.samples.get(container_id)
+        if sample and time.time() - sample['read_at'] <= self.max_age:
+            return sample
+        return None
+
+    def read(self, container_id):
+        sample = self.get(container_id)
+        if sample is None and self.client is not None:
+            self.watch(container_id)
+            frame = self.client.containers.get(container_id).stats(stream=False)
+            sample = self.summarize(frame)
+        return sample
+
+    def _stream(self, container_id, stop):
+        previous = None
+        try:
+            container = self.client.containers.get(container_id)
+            for frame in container.stats(stream=True, decode=True):
+                if stop.is_set():
+                    break
+                sample = self.summarize(frame, previous)
+                previous = frame
+                with self.lock:
+                    if self.streams.get(container_id) is stop:
+                        self.samples[container_id] = sample
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            logger.warning(f"Stats stream for {container_id[:12]} ended: {e}")
+        finally:
+            with self.lock:
+                if self.streams.get(container_id) is stop:
+                    del self.streams[container_id]
+                    self.samples.pop(container_id, None)
+
+    def stop(self):
+        with self.lock:
+            streams, self.streams = self.streams, {}
+            self.samples = {}
+        for stop in streams.values():
+            stop.set()
+
+class HostMetricsSampler:
+    """Host CPU and connection counts from /proc/stat deltas and /proc/net/sockstat."""
+
+    def __init__(self, proc_root='/proc'):
+        self.proc_root = proc_root
+        self.previous_cpu = self._read_cpu_times()
+
+    def _read_cpu_times(self):
+        try:
+            with open(os.path.join(self.proc_root, 'stat')) as f:
+                fields = [int(value) for value in f.readline().split()[1:9]]
+        except (OSError, ValueError):
+            return None
+        return sum(fields), fields[3] + fields[4]
+
+    def cpu_percent(self):
+        current = self._read_cpu_times()
+        if current is None:
+            return psutil.cpu_percent(interval=None)
+        previous, self.previous_cpu = self.previous_cpu, current
+        if previous is None:
+            return 0.0
+        total = current[0] - previous[0]
+        idle = current[1] - previous[1]
+        return round((total - idle) / total * 100, 1) if total > 0 else 0.0
+
+    def connection_count(self):
+        count = 0
+        for name in ('sockstat', 'sockstat6'):
+            try:
+                with open(os.path.join(self.proc_root, 'net', name)) as f:
+                    for line in f:
+                        proto, _, rest = line.partition(':')
+                        if proto in ('TCP', 'UDP', 'TCP6', 'UDP6'):
+                            fields = rest.split()
+                            count += int(fields[fields.index('inuse') + 1])
+            except (OSError, ValueError, IndexError):
+                continue
+        return count
+
+    def sample(self):
+        mem = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net = psutil.net_io_counters()
+        return {
+            'cpu_usage': self.cpu_percent(),
+            'memory_usage': mem.percent,
+            'memory_used': mem.used / (1024 ** 3),
+            'memory_total': mem.total / (1024 ** 3),
+            'disk_usage': disk.percent,
+            'disk_used': disk.used / (1024 ** 3),
+            'disk_total': disk.total / (1024 ** 3),
+            'network_sent': net.bytes_sent / (1024 ** 2),
+            'network_recv': net.bytes_recv / (1024 ** 2),
+            'active_connections': self.connection_count(),
+            'last_updated': time.time()
+        }
+
+class DiskAccountant:
+    """Per-VPS volume usage measured from the host on a budgeted background scan."""
+
+    def __init__(self, client, budget=DISK_SCAN_BUDGET, warn_percent=DISK_QUOTA_WARN_PERCENT):
+        self.client = client
+        self.budget = budget
+        self.warn_percent = warn_percent
+        self.usage = {}
+        self.cursor = 0
+        self.alerted = {}
+
+    @staticmethod
+    def directory_usage(path):
+        total = 0
+        seen = set()
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                        except OSError:
+                            continue
+                        if st.st_nlink > 1:
+                            if (st.st_dev, st.st_ino) in seen:
+                                continue
+                            seen.add((st.st_dev, st.st_ino))
+                        total += st.st_blocks * 512
+            except OSError:
+                continue
+        return total
+
+    def _layer_sizes(self):
+        if self.client is None:
+            return {}
+        try:
+            return {c['Id']: c.get('SizeRw') or 0 for c in self.client.api.containers(size=True)}
+        except Exception as e:
+            logger.warning(f"Writable layer sizes unavailable: {e}")
+            return {}
+
+    def refresh(self, all_vps):
+        deadline = time.monotonic() + self.budget
+        layers = self._layer_sizes()
+        vps_ids = sorted(all_vps)
+        scanned = {}
+        if vps_ids:
+            start = self.cursor % len(vps_ids)
+            for offset in range(len(vps_ids)):
+                if time.monotonic() > deadline:
+                    break
+                vps_id = vps_ids[(start + offset) % len(vps_ids)]
+                scanned[vps_id] = self.directory_usage(DOCKER_VOLUME_PATH.format(vps_id=vps_id))
+                self.cursor = start + offset + 1
+
+        usage = {}
+        for vps_id in vps_ids:
+            vps = all_vps[vps_id]
+            previous = self.usage.get(vps_id, {})
+            volume_bytes = scanned.get(vps_id, previous.get('volume_bytes', 0))
+            layer_bytes = layers.get(vps['container_id'], previous.get('layer_bytes', 0))
+            quota_bytes = int(vps.get('disk') or 0) * 1024 ** 3
+            used_bytes = volume_bytes + layer_bytes
+            usage[vps_id] = {
+                'volume_bytes': volume_bytes,
+                'layer_bytes': layer_bytes,
+                'used_bytes': used_bytes,
+                'quota_bytes': quota_bytes,
+                'percent': round(used_bytes / quota_bytes * 100, 2) if quota_bytes else 0,
+                'scanned_at': time.time() if vps_id in scanned else previous.get('scanned_at')
+            }
+        self.usage = usage
+        self.check_quotas(all_vps)
+        return len(scanned)
+
+    def check_quotas(self, all_vps):
+        for vps_id in list(self.alerted):
+            if vps_id not in self.usage:
+                del self.alerted[vps_id]
+        for vps_id, entry in self.usage.items():
+            level = 'exceeded' if entry['percent'] >= 100 else 'warning' if entry['percent'] >= self.warn_percent else None
+            if level == self.alerted.get(vps_id):
+                continue
+            if level is None:
+                self.alerted.pop(vps_id, None)
+                continue
+            self.alerted[vps_id] = level
+            vps = all_vps[vps_id]
+            message = f"VPS {vps_id} disk usage at {entry['percent']}% of its {vps.get('disk')}GB quota"
+            logger.warning(message)
+            db.add_notification(vps['created_by'], message)
+            socketio.emit('vps_disk_alert', {'vps_id': vps_id, 'level': level, **entry}, namespace='/admin')
+
+    def get(self, vps_id):
+        entry = self.usage.get(vps_id)
+        if not entry:
+            return {'used_mb': 0, 'total_mb': 0, 'percent': 0, 'error': 'Not measured yet'}
+        return {
+            'used_mb': round(entry['used_bytes'] / (1024 ** 2), 2),
+            'total_mb': round(entry['quota_bytes'] / (1024 ** 2), 2),
+            'percent': entry['percent'],
+            'error': None
+        }
+
+class ContainerStateIndex:
+    """Container states kept current from the Docker events stream."""
+
+    EVENTS = ('start', 'die', 'oom', 'destroy', 'pause', 'unpause', 'health_status')
+    PANEL_STATES = ('suspended', 'expired')
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.ready = threading.Event()
+
+    @staticmethod
+    def _health(summary):
+        status = summary.get('Status') or ''
+        for health in ('healthy', 'unhealthy', 'starting'):
+            if f'({health})' in status or f'(health: {health})' in status:
+                return health
+        return None
+
+    def reconcile(self):
+        containers = {}
+        for summary in self.client.api.containers(all=True):
+            containers[summary['Id']] = {'status': summary.get('State'), 'health': self._health(summary), 'oom': False}
+        with self.lock:
+            for container_id, state in containers.items():
+                state['oom'] = self.containers.get(container_id, {}).get('oom', False)
+            self.containers = containers
+        self.ready.set()
+        self.apply(db.get_all_vps())
+
+    def get(self, container_id):
+        return self.containers.get(container_id)
+
+    def status(self, container_id):
+        state = self.containers.get(container_id)
+        return state['status'] if state else 'not_found'
+
+    def exited(self):
+        with self.lock:
+            return [cid for cid, state in self.containers.items() if state['status'] == 'exited']
+
+    def handle(self, event):
+        action = event.get('Action') or event.get('status') or ''
+        action, _, detail = action.partition(':')
+        if action not in self.EVENTS:
+            return
+        container_id = event.get('id') or event.get('Actor', {}).get('ID')
+        with self.lock:
+            state = self.containers.setdefault(container_id, {'status': 'created', 'health': None, 'oom': False})
+            if action == 'start':
+                state.update(status='running', oom=False)
+            elif action == 'die':
+                state['status'] = 'exited'
+            elif action == 'oom':
+                state['oom'] = True
+            elif action == 'destroy':
+                del self.containers[container_id]
+            elif action == 'pause':
+                state['status'] = 'paused'
+            elif action == 'unpause':
+                state['status'] = 'running'
+            elif action == 'health_status':
+                state['health'] = detail.strip()
+
+        if action in ('die', 'destroy'):
+            stats_hub.unwatch(container_id)
+        vps = db.get_vps_by_container(container_id)
+        if vps is None:
+            return
+        if action == 'start' and not cgroup_reader.readable(container_id):
+            stats_hub.watch(container_id)
+        if action == 'oom':
+            logger.warning(f"VPS {vps['vps_id']} hit its memory limit")
+            socketio.emit('vps_oom', {'vps_id': vps['vps_id']}, namespace='/admin')
+        elif action == 'health_status':
+            socketio.emit('vps_health', {'vps_id': vps['vps_id'], 'health': detail.strip()}, namespace='/admin')
+        self.apply({vps['token']: vps})
+
+    def apply(self, vps_map):
+        for token, vps in vps_map.items():
+            status = self.status(vps['container_id'])
+            if status == vps['status'] or (vps['status'] in self.PANEL_STATES and status != 'running'):
+                continue
+            if db.sync_vps_status(token, status, self.PANEL_STATES):
+                socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': status}, namespace='/admin')
+
+    def listen(self):
+        backoff = 1
+        while True:
+            try:
+                self.reconcile()
+                stream = self.client.events(decode=True, filters={'type': 'container'})
+                backoff = 1
+                for event in stream:
+                    try:
+                        self.handle(event)
+                    except Exception as e:
+                        logger.error(f"Container event error: {e}")
+            except Exception as e:
+                logger.error(f"Docker events stream error: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+class Scheduler:
+    """Runs named periodic jobs with jitter on a shared worker pool, skipping overlapping runs."""
+
+    def __init__(self, snapshot_max_age=1.0):
+        self.jobs = {}
+        self.snapshot_max_age = snapshot_max_age
+        self.last_snapshot = (0.0, None)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.executor = None
+        self.thread = None
+
+    def add(self, name, func, interval, jitter=0.1, initial_delay=0, snapshot=False):
+        self.jobs[name] = {
+            'func': func,
+            'interval': interval,
+            'jitter': jitter,
+            'snapshot': snapshot,
+            'next_run': time.monotonic() + initial_delay + random.uniform(0, interval * jitter),
+            'future': None,
+            'runs': 0,
+            'failures': 0,
+            'skipped': 0,
+            'last_run': None,
+            'last_duration': None,
+            'max_duration': 0.0,
+            'last_error': None
+        }
+        return self
+
+    def start(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.jobs)), thread_name_prefix='job')
+        self.thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run_job(self, name, job, all_vps):
+        started = time.perf_counter()
+        error = None
+        try:
+            if job['snapshot']:
+                job['func'](all_vps)
+            else:
+                job['func']()
+        except Exception as e:
+            error = str(e)
+            JOB_FAILURES.labels(name).inc()
+            logger.error(f"Job {name} failed: {e}", exc_info=True)
+        duration = time.perf_counter() - started
+        LOOP_SECONDS.labels(name).observe(duration)
+        with self.lock:
+            job['runs'] += 1
+            job['last_run'] = time.time()
+            job['last_duration'] = duration
+            job['max_duration'] = max(job['max_duration'], duration)
+            if error is not None:
+                job['failures'] += 1
+                job['last_error'] = error
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            due = []
+            with self.lock:
+                for name, job in self.jobs.items():
+                    if job['next_run'] > now:
+                        continue
+                    job['next_run'] = now + job['interval'] * (1 + random.uniform(-job['jitter'], job['jitter']))
+                    if job['future'] is not None and not job['future'].done():
+                        job['skipped'] += 1
+                        JOB_SKIPPED.labels(name).inc()
+                        continue
+                    due.append((name, job))
+                next_run = min((job['next_run'] for job in self.jobs.values()), default=now + 1)
+
+            all_vps = None
+            if any(job['snapshot'] for _, job in due):
+                all_vps = self._snapshot(now)
+            for name, job in due:
+                if job['snapshot'] and all_vps is None:
+                    continue
+                job['future'] = self.executor.submit(self._run_job, name, job, all_vps)
+            self.stopped.wait(max(0.05, next_run - time.monotonic()))
+
+    def _snapshot(self, now):
+        taken_at, all_vps = self.last_snapshot
+        if all_vps is not None and now - taken_at < self.snapshot_max_age:
+            return all_vps
+        try:
+            all_vps = db.get_all_vps()
+        except Exception as e:
+            logger.error(f"Scheduler snapshot failed: {e}")
+            return None
+        self.last_snapshot = (now, all_vps)
+        return all_vps
+
+    def get_metrics(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                name: {
+                    'interval': job['interval'],
+                    'running': job['future'] is not None and not job['future'].done(),
+                    'next_run_in': round(job['next_run'] - now, 2),
+                    **{key: job[key] for key in ('runs', 'failures', 'skipped', 'last_run', 'last_duration', 'max_duration', 'last_error')}
+                }
+                for name, job in self.jobs.items()
+            }
+
+    def stop(self, timeout=10):
+        self.stopped.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+        if self.executor is None:
+            return
+        running = [job['future'] for job in self.jobs.values() if job['future'] is not None]
+        concurrent.futures.wait(running, timeout=timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class AbuseDetector:
+    """Scores a VPS for abuse from process, pool-connection and sustained CPU signals."""
+
+    def __init__(self, threshold=ABUSE_CPU_THRESHOLD, window_seconds=ABUSE_SUSTAINED_SECONDS, weights=ABUSE_WEIGHTS, suspend_score=ABUSE_SUSPEND_SCORE):
+        self.threshold = threshold
+        self.window = max(1, window_seconds // HISTORY_SAMPLE_INTERVAL)
+        self.weights = weights
+        self.suspend_score = suspend_score
+        self.host_cpus = os.cpu_count() or 1
+        self.decisions = {}
+
+    def cpu_signals(self, vps):
+        ring = resource_history.get(vps['vps_id'])
+        if ring is None or len(ring) < self.window * 0.8:
+            return None
+        allotted = float(vps.get('cpu') or self.host_cpus)
+        scale = self.host_cpus / allotted
+        values = [value * scale for segment in ring.views(self.window)['cpu'] for value in segment.tolist()]
+        ewma = values[0]
+        for value in values[1:]:
+            ewma = ABUSE_EWMA_ALPHA * value + (1 - ABUSE_EWMA_ALPHA) * ewma
+        above = sum(1 for value in values if value >= self.threshold) / len(values)
+        return {'ewma': round(ewma, 1), 'above_fraction': round(above, 2)}
+
+    def evaluate(self, vps, commands, remote_ports):
+        signals = {}
+        matches = sorted({match.group(0).lower() for command in commands for match in [MINER_REGEX.search(command)] if match})
+        if matches:
+            signals['process'] = matches
+        stratum = sorted(remote_ports & STRATUM_PORTS)
+        if stratum:
+            signals['stratum'] = stratum
+        cpu = self.cpu_signals(vps)
+        if cpu and cpu['above_fraction'] >= ABUSE_SUSTAINED_FRACTION:
+            signals['sustained_cpu'] = cpu['above_fraction']
+            if cpu['ewma'] >= self.threshold:
+                signals['ewma_cpu'] = cpu['ewma']
+        score = round(sum(self.weights[name] for name in signals), 2)
+        decision = {
+            'vps_id': vps['vps_id'],
+            'score': score,
+            'signals': signals,
+            'cpu': cpu,
+            'suspend': score >= self.suspend_score,
+            'checked_at': time.time()
+        }
+        self.decisions[vps['vps_id']] = decision
+        if decision['suspend']:
+            logger.warning(f"Abuse check {vps['vps_id']}: score={score} signals={signals} cpu={cpu} -> suspend")
+        elif signals:
+            logger.info(f"Abuse check {vps['vps_id']}: score={score} signals={signals} cpu={cpu} -> allow")
+        return decision
+
+    @staticmethod
+    def describe(decision):
+        names = {'process': 'mining processes', 'stratum': 'mining pool connections', 'sustained_cpu': 'sustained high CPU', 'ewma_cpu': 'sustained high CPU'}
+        return ', '.join(dict.fromkeys(names[name] for name in decision['signals']))
+
+class AntiMinerScanner:
+    """Scans container processes from host /proc for miners under a CPU budget."""
+
+    def __init__(self, client, cgroup, detector, workers=ANTI_MINER_WORKERS, cpu_budget=ANTI_MINER_CPU_BUDGET, proc_root='/proc'):
+        self.client = client
+        self.cgroup = cgroup
+        self.detector = detector
+        self.workers = workers
+        self.worker_budget = cpu_budget / workers
+        self.proc_root = proc_root
+
+    def commands(self, container_id):
+        pids = self.cgroup.pids(container_id)
+        if pids is None:
+            top = self.client.api.top(container_id)
+            return [row[-1] for row in top.get('Processes') or []]
+        commands = []
+        for pid in pids:
+            try:
+                with open(os.path.join(self.proc_root, str(pid), 'cmdline'), 'rb') as f:
+                    cmdline = f.read().replace(b'\0', b' ').strip()
+                if not cmdline:
+                    with open(os.path.join(self.proc_root, str(pid), 'comm'), 'rb') as f:
+                        cmdline = f.read().strip()
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            commands.append(cmdline.decode(errors='replace'))
+        return commands
+
+    @staticmethod
+    def parse_tcp_remote_ports(text):
+        ports = set()
+        for line in text.splitlines()[1:]:
+            fields = line.split()
+            if len(fields) > 3 and fields[3] == '01':
+                ports.add(int(fields[2].rsplit(':', 1)[1], 16))
+        return ports
+
+    def remote_ports(self, container_id):
+        pids = self.cgroup.pids(container_id)
+        ports = set()
+        for name in ('tcp', 'tcp6'):
+            try:
+                with open(os.path.join(self.proc_root, str(pids[0]), 'net', name)) as f:
+                    ports |= self.parse_tcp_remote_ports(f.read())
+            except (TypeError, IndexError, OSError, ValueError):
+                continue
+        return ports
+
+    def inspect(self, vps):
+        """Return the reason to suspend this VPS, or None."""
+        decision = self.detector.evaluate(vps, self.commands(vps['container_id']), self.remote_ports(vps['container_id']))
+        return self.detector.describe(decision) if decision['suspend'] else None
+
+    def _check(self, token, vps):
+        started = time.thread_time()
+        try:
+            reason = self.inspect(vps)
+        except docker.errors.NotFound:
+            return None
+        finally:
+            spent = time.thread_time() - started
+            if self.worker_budget > 0:
+                time.sleep(spent / self.worker_budget - spent)
+        if reason:
+            self.suspend(token, vps, reason)
+        return reason
+
+    def suspend(self, token, vps, reason):
+        try:
+            self.client.api.stop(vps['container_id'])
+        except docker.errors.NotFound:
+            pass
+        db.update_vps(token, {'status': 'suspended'})
+        db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} suspended due to {reason}')
+        logger.warning(f"VPS {vps['vps_id']} suspended due to {reason}")
+
+    def scan(self, all_vps):
+        running = [(token, vps) for token, vps in all_vps.items() if vps['status'] == 'running']
+        live_ids = {vps['vps_id'] for _, vps in running}
+        self.detector.decisions = {vps_id: d for vps_id, d in self.detector.decisions.items() if vps_id in live_ids}
+        suspended = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='anti-miner') as pool:
+            futures = {pool.submit(self._check, token, vps): vps['vps_id'] for token, vps in running}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    suspended += bool(future.result())
+                except Exception as e:
+                    logger.error(f"Anti-miner check for {futures[future]} failed: {e}")
+        return suspended
+
+class ExpiryScheduler:
+    """Fires VPS expiry warnings and expiries from a min-heap of due times."""
+
+    def __init__(self, leads=EXPIRY_WARNING_LEADS):
+        self.leads = sorted(set(leads), reverse=True)
+        self.heap = []
+        self.current = {}
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+    @staticmethod
+    def _timestamp(expires_at):
+        return datetime.datetime.fromisoformat(expires_at).timestamp()
+
+    def _push_locked(self, vps_id, expires_at, now):
+        if not expires_at:
+            self.current.pop(vps_id, None)
+            return
+        expires = self._timestamp(expires_at)
+        self.current[vps_id] = expires
+        for lead in self.leads:
+            if expires - lead > now:
+                heapq.heappush(self.heap, (expires - lead, vps_id, expires, lead))
+        heapq.heappush(self.heap, (expires, vps_id, expires, 0))
+
+    def schedule(self, vps_id, expires_at):
+        with self.condition:
+            self._push_locked(vps_id, expires_at, time.time())
+            self.condition.notify()
+
+    def load(self, all_vps):
+        now = time.time()
+        with self.condition:
+            self.heap = []
+            self.current = {}
+            for vps in all_vps.values():
+                if vps['status'] != 'expired':
+                    self._push_locked(vps['vps_id'], vps.get('expires_at'), now)
+            self.condition.notify()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='expiry', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    delay = self.heap[0][0] - time.time() if self.heap else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self.condition.wait(delay)
+                if self.stopped:
+                    return
+                due, vps_id, expires, lead = heapq.heappop(self.heap)
+                if self.current.get(vps_id) != expires:
+                    continue
+                if lead == 0:
+                    del self.current[vps_id]
+            try:
+                if lead:
+                    self.warn(vps_id, expires, lead)
+                else:
+                    self.expire(vps_id, expires)
+            except Exception as e:
+                logger.error(f"Expiry handling for {vps_id} failed: {e}")
+
+    def _lookup(self, vps_id, expires):
+        token, vps = db.get_vps_by_id(vps_id)
+        if not vps or not vps.get('expires_at') or self._timestamp(vps['expires_at']) != expires:
+            return None, None
+        return token, vps
+
+    def warn(self, vps_id, expires, lead):
+        token, vps = self._lookup(vps_id, expires)
+        if not vps or vps['status'] == 'expired':
+            return
+        hours = lead / 3600
+        when = f"{hours:g} hour{'s' if hours != 1 else ''}" if lead >= 3600 else f"{lead // 60} minutes"
+        db.add_notification(vps['created_by'], f'VPS {vps_id} expires in {when}')
+        user = db.get_user_by_id(vps['created_by'])
+        if user and user.get('email'):
+            send_email(user['email'], 'VPS Expiring Soon', f'Your VPS {vps_id} expires in {when}.')
+
+    def expire(self, vps_id, expires):
+        token, vps = self._lookup(vps_id, expires)
+        if not vps or vps['status'] == 'expired':
+            return
+        try:
+            docker_client.api.stop(vps['container_id'])
+        except docker.errors.NotFound:
+            pass
+        db.update_vps(token, {'status': 'expired'})
+        db.add_notification(vps['created_by'], f'VPS {vps_id} has expired')
+        socketio.emit('vps_status', {'vps_id': vps_id, 'status': 'expired'}, namespace='/admin')
+        logger.info(f"VPS {vps_id} expired")
+        user = db.get_user_by_id(vps['created_by'])
+        if user and user.get('email'):
+            send_email(user['email'], 'VPS Expired', f'Your VPS {vps_id} has expired.')
+
+class SingleFlightCache:
+    """TTL cache where concurrent misses for the same key share a single load."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.inflight = {}
 
-    def close(self):
-        self.conn.close()
+    def get(self, key, loader):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.inflight[key] = future
+        if not owner:
+            return future.result()
+        try:
+            value = loader()
+        except Exception as e:
+            with self.lock:
+                self.inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
 
 db = Database(DB_FILE)
+history_writer = ResourceHistoryWriter(db).start()
+stat_counter = StatCounter(db).start()
+atexit.register(history_writer.stop)
+atexit.register(stat_counter.stop)
+email_outbox = EmailOutbox(db, SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASS, starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT,
+                           flush_interval=EMAIL_FLUSH_INTERVAL, batch_size=EMAIL_BATCH_SIZE, max_attempts=EMAIL_MAX_ATTEMPTS,
+                           retry_base=EMAIL_RETRY_BASE, dedupe_window=EMAIL_DEDUPE_WINDOW, idle_timeout=EMAIL_IDLE_TIMEOUT,
+                           metric=EMAIL_OUTBOX_TOTAL).start()
+atexit.register(email_outbox.stop)
+
+def docker_operation(method, path_url):
+    parts = urlsplit(path_url).path.strip('/').split('/')
+    if parts and re.match(r'v\d+\.\d+$', parts[0]):
+        parts = parts[1:]
+    if len(parts) >= 3:
+        parts = [parts[0], '{id}', parts[-1]]
+    elif len(parts) == 2 and method == 'DELETE':
+        parts[1] = '{id}'
+    return f"{method} /{'/'.join(parts)}"
+
+def instrument_docker_client(client):
+    send = client.api.send
+
+    def timed_send(request, **kwargs):
+        started = time.perf_counter()
+        try:
+            return send(request, **kwargs)
+        finally:
+            DOCKER_API_SECONDS.labels(docker_operation(request.method, request.path_url)).observe(time.perf_counter() - started)
+
+    client.api.send = timed_send
+    return client
 
 try:
-    docker_client = docker.from_env()
+    docker_client = instrument_docker_client(docker.from_env())
     try:
         docker_client.networks.get(DOCKER_NETWORK)
     except docker.errors.NotFound:
@@ -807,11 +1873,26 @@ except Exception as e:
     logger.error(f"Docker init failed: {e}")
     docker_client = None
 
+stats_hub = DockerStatsHub(docker_client)
+atexit.register(stats_hub.stop)
+cgroup_reader = CgroupReader(CGROUP_ROOT, max_age=STATS_HUB_MAX_AGE)
+disk_accountant = DiskAccountant(docker_client)
+container_index = ContainerStateIndex(docker_client)
+expiry = ExpiryScheduler()
+abuse_detector = AbuseDetector()
+anti_miner = AntiMinerScanner(docker_client, cgroup_reader, abuse_detector)
+system_info_cache = SingleFlightCache(SYSTEM_INFO_TTL)
+
 system_stats = {}
+host_sampler = HostMetricsSampler()
 vps_stats_cache = {}
 console_sessions = {}
 image_build_lock = threading.Lock()
-resource_history = {vps_id: deque(maxlen=3600) for vps_id in db.get_all_vps()}
+resource_history = {vps_id: ResourceRing(RESOURCE_RING_SIZE) for vps_id in db.get_all_vps()}
+stats_executor = concurrent.futures.ThreadPoolExecutor(max_workers=STATS_COLLECTOR_WORKERS, thread_name_prefix='vps-stats')
+stats_in_flight = set()
+stats_in_flight_lock = threading.Lock()
+stats_cycle_metrics = {'cycles': 0, 'last_duration': 0.0, 'max_duration': 0.0, 'last_collected': 0, 'timeouts': 0, 'errors': 0}
 
 def generate_token():
     return str(uuid.uuid4())
@@ -823,9 +1904,27 @@ def generate_ssh_password():
     chars = string.ascii_letters + string.digits + "!@#$%^&*()_+-=[]{}|;:,.<>?"
     return ''.join(random.choices(chars, k=20))
 
+def get_user_role(user):
+    roles = g.setdefault('user_roles', {}) if has_request_context() else {}
+    if user.id not in roles:
+        if isinstance(user, User):
+            roles[user.id] = user.role
+        else:
+            user_data = db.get_user_by_id(user.id)
+            roles[user.id] = user_data['role'] if user_data else None
+    return roles[user.id]
+
+def invalidate_user_role(user_id):
+    if has_request_context():
+        g.setdefault('user_roles', {}).pop(user_id, None)
+        if current_user.is_authenticated and current_user.id == user_id:
+            user_data = db.get_user_by_id(user_id)
+            current_user.role = user_data['role'] if user_data else None
+
 def is_admin(user):
-    user_data = db.get_user_by_id(user.id)
-    return user_data['role'] == 'admin' if user_data else False
+    if not getattr(user, 'is_authenticated', False):
+        return False
+    return get_user_role(user) == 'admin'
 
 def admin_required(f):
     @wraps(f)
@@ -851,81 +1950,119 @@ def run_command(command, timeout=30):
 def run_docker_command(container_id, command, timeout=1200):
     if isinstance(command, str):
         command = shlex.split(command)
+    started = time.perf_counter()
+    result = 'error'
     try:
-        result = subprocess.run(["docker", "exec", container_id] + command, capture_output=True, text=True, timeout=timeout, check=True)
-        return True, result.stdout, result.stderr
+        completed = subprocess.run(["docker", "exec", container_id] + command, capture_output=True, text=True, timeout=timeout, check=True)
+        result = 'ok'
+        return True, completed.stdout, completed.stderr
     except subprocess.CalledProcessError as e:
+        result = 'failed'
         return False, e.stdout, e.stderr
     except subprocess.TimeoutExpired:
+        result = 'timeout'
         return False, "", "Timeout"
     except Exception as e:
         return False, "", str(e)
+    finally:
+        DOCKER_EXEC_TOTAL.labels(result).inc()
+        DOCKER_EXEC_SECONDS.observe(time.perf_counter() - started)
 
 def update_system_stats():
     global system_stats
     try:
-        cpu = psutil.cpu_percent(interval=0.1)
-        mem = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        net = psutil.net_io_counters()
-        system_stats = {
-            'cpu_usage': cpu,
-            'memory_usage': mem.percent,
-            'memory_used': mem.used / (1024 ** 3),
-            'memory_total': mem.total / (1024 ** 3),
-            'disk_usage': disk.percent,
-            'disk_used': disk.used / (1024 ** 3),
-            'disk_total': disk.total / (1024 ** 3),
-            'network_sent': net.bytes_sent / (1024 ** 2),
-            'network_recv': net.bytes_recv / (1024 ** 2),
-            'active_connections': len(psutil.net_connections()),
-            'last_updated': time.time()
-        }
+        system_stats = host_sampler.sample()
     except Exception as e:
         logger.error(f"System stats error: {e}")
 
-def update_vps_stats():
+def core_cpu_percent(host_percent):
+    # History stores CPU as a share of the whole host; the panel charts it on
+    # the per-core scale the live bars use, where 100 is one full core.
+    return round(min(host_percent * HOST_CPUS, 100.0), 2)
+
+def container_sample(container_id):
+    return cgroup_reader.get(container_id) or stats_hub.read(container_id)
+
+def collect_vps_stats(vps_id, vps):
+    sample = container_sample(vps['container_id'])
+    mem_usage = sample['memory_usage'] / (1024 ** 2)
+    mem_limit = (sample['memory_limit'] or 1) / (1024 ** 2)
+    cpu_usage = sample['cpu_host_percent']
+    net_in = sample['net_rx'] / (1024 ** 2)
+    net_out = sample['net_tx'] / (1024 ** 2)
+    uptime_start = datetime.datetime.fromisoformat(vps['uptime_start'])
+    uptime_seconds = (datetime.datetime.now() - uptime_start).total_seconds()
+    restart_count = vps.get('restart_count', 0)
+    assumed_downtime = restart_count * 60
+    uptime_percent = ((uptime_seconds - assumed_downtime) / uptime_seconds * 100) if uptime_seconds > 0 else 100
+    disk_usage = disk_accountant.get(vps_id)['percent']
+    summary = {
+        'cpu_percent': round(cpu_usage, 2),
+        'memory_percent': round((mem_usage / mem_limit) * 100, 2),
+        'net_in_mb': round(net_in, 2),
+        'net_out_mb': round(net_out, 2),
+        'disk_percent': round(disk_usage, 2),
+        'status': 'running',
+        'uptime_seconds': uptime_seconds,
+        'uptime_percent': round(uptime_percent, 2)
+    }
+    return summary, (cpu_usage, (mem_usage / mem_limit * 100), disk_usage, net_in, net_out)
+
+def update_vps_stats(all_vps=None):
     global vps_stats_cache
+    started = time.perf_counter()
+    snapshot = {}
+    futures = {}
     try:
-        for vps_id, vps in db.get_all_vps().items():
+        if all_vps is None:
+            all_vps = db.get_all_vps()
+        running = [vps['container_id'] for vps in all_vps.values() if vps['status'] == 'running']
+        sampled = cgroup_reader.sample_all(running)
+        stats_hub.sync(container_id for container_id in running if container_id not in sampled)
+        for vps_id, vps in all_vps.items():
             if vps['status'] != 'running':
-                vps_stats_cache[vps_id] = {'status': vps['status']}
+                snapshot[vps_id] = {'status': vps['status']}
+                continue
+            with stats_in_flight_lock:
+                busy = vps_id in stats_in_flight
+                stats_in_flight.add(vps_id)
+            if busy:
+                snapshot[vps_id] = {**vps_stats_cache.get(vps_id, {'status': 'running'}), 'stale': True}
                 continue
+            future = stats_executor.submit(collect_vps_stats, vps_id, vps)
+            future.add_done_callback(lambda _, vps_id=vps_id: stats_in_flight.discard(vps_id))
+            futures[future] = vps_id
+
+        done, pending = concurrent.futures.wait(futures, timeout=STATS_COLLECTOR_TIMEOUT)
+        for future in done:
+            vps_id = futures[future]
             try:
-                container = docker_client.containers.get(vps['container_id'])
-                stats = container.stats(stream=False)
-                mem_stats = stats['memory_stats']
-                cpu_stats = stats['cpu_stats']
-                net_stats = stats.get('networks', {})
-                mem_usage = mem_stats.get('usage', 0) / (1024 ** 2)
-                mem_limit = mem_stats.get('limit', 1) / (1024 ** 2)
-                cpu_usage = (cpu_stats['cpu_usage']['total_usage'] / cpu_stats['system_cpu_usage']) * 100 if cpu_stats.get('system_cpu_usage') else 0
-                net_in = sum(iface['rx_bytes'] for iface in net_stats.values()) / (1024 ** 2)
-                net_out = sum(iface['tx_bytes'] for iface in net_stats.values()) / (1024 ** 2)
-                uptime_start = datetime.datetime.fromisoformat(vps['uptime_start'])
-                uptime_seconds = (datetime.datetime.now() - uptime_start).total_seconds()
-                restart_count = vps.get('restart_count', 0)
-                assumed_downtime = restart_count * 60
-                uptime_percent = ((uptime_seconds - assumed_downtime) / uptime_seconds * 100) if uptime_seconds > 0 else 100
-                disk_usage = psutil.disk_usage(f'/var/lib/docker/volumes/hvm-{vps_id}/_data').percent if os.path.exists(f'/var/lib/docker/volumes/hvm-{vps_id}/_data') else 0
-                vps_stats_cache[vps_id] = {
-                    'cpu_percent': round(cpu_usage, 2),
-                    'memory_percent': round((mem_usage / mem_limit) * 100, 2),
-                    'net_in_mb': round(net_in, 2),
-                    'net_out_mb': round(net_out, 2),
-                    'disk_percent': round(disk_usage, 2),
-                    'status': 'running',
-                    'uptime_seconds': uptime_seconds,
-                    'uptime_percent': round(uptime_percent, 2)
-                }
-                db.add_resource_history(vps_id, cpu_usage, (mem_usage / mem_limit * 100), disk_usage, net_in, net_out)
-                resource_history[vps_id].append(vps_stats_cache[vps_id])
-                socketio.emit('vps_update', vps_stats_cache[vps_id], room=vps_id, namespace='/vps')
+                summary, sample = future.result()
             except Exception as e:
                 logger.error(f"VPS {vps_id} stats error: {e}")
-                vps_stats_cache[vps_id] = {'status': 'error'}
+                snapshot[vps_id] = {'status': 'error'}
+                stats_cycle_metrics['errors'] += 1
+                continue
+            snapshot[vps_id] = summary
+            history_writer.add(vps_id, *sample)
+            ring = resource_history.get(vps_id)
+            if ring is None:
+                ring = resource_history[vps_id] = ResourceRing(RESOURCE_RING_SIZE)
+            ring.append(time.time(), *sample)
+        for future in pending:
+            vps_id = futures[future]
+            logger.warning(f"VPS {vps_id} stats timed out after {STATS_COLLECTOR_TIMEOUT}s")
+            snapshot[vps_id] = {**vps_stats_cache.get(vps_id, {'status': 'running'}), 'stale': True}
+            stats_cycle_metrics['timeouts'] += 1
+        vps_stats_cache = snapshot
     except Exception as e:
         logger.error(f"VPS stats update error: {e}")
+    finally:
+        duration = time.perf_counter() - started
+        stats_cycle_metrics['cycles'] += 1
+        stats_cycle_metrics['last_duration'] = duration
+        stats_cycle_metrics['max_duration'] = max(stats_cycle_metrics['max_duration'], duration)
+        stats_cycle_metrics['last_collected'] = len(futures)
 
 def build_custom_image(base_image=DEFAULT_OS_IMAGE, dockerfile_content=None):
     with image_build_lock:
@@ -1043,17 +2180,9 @@ def allowed_file(filename):
 
 def send_email(to_email, subject, body):
     try:
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = SMTP_USER
-        msg['To'] = to_email
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(SMTP_USER, to_email, msg.as_string())
-        return True
+        return email_outbox.enqueue(to_email, subject, body)
     except Exception as e:
-        logger.error(f"Email send error: {e}")
+        logger.error(f"Email enqueue error: {e}")
         return False
 
 def validate_license(key):
@@ -1075,9 +2204,36 @@ def validate_license(key):
         return False, str(e)
         
 
+@app.context_processor
+def inject_settings():
+    return {
+        'panel_name': db.get_setting('panel_name', PANEL_NAME),
+        'server_ip': db.get_setting('server_ip', SERVER_IP),
+        'theme': current_user.theme if current_user.is_authenticated else 'light'
+    }
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.teardown_request
+def record_request_latency(exc):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.labels(request.endpoint or 'unmatched', request.method).observe(time.perf_counter() - started)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            return jsonify({'error': 'Unauthorized'}), 401
+    elif not current_user.is_authenticated or not is_admin(current_user):
+        return jsonify({'error': 'Admin required'}), 403
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 @app.before_request
 def check_maintenance():
-    if request.path.startswith('/static') or request.endpoint in ['login', 'logout']:
+    if request.path.startswith('/static') or request.endpoint in ['login', 'logout', 'prometheus_metrics']:
         return
     if db.get_setting('maintenance_mode', 'off') == 'on':
         if not current_user.is_authenticated or not is_admin(current_user):
@@ -1334,12 +2490,14 @@ def create_vps():
             }
 
             if db.add_vps(vps_data):
+                stat_counter.increment('total_vps_created')
+                expiry.schedule(vps_id, vps_data['expires_at'])
                 db.log_action(current_user.id, 'create_vps', f'Created VPS {vps_id}')
                 db.add_notification(user_id, f'New VPS {vps_id} created')
                 user = db.get_user_by_id(user_id)
                 if user.get('email'):
                     send_email(user['email'], 'VPS Created', f'Your new VPS {vps_id} is ready.')
-                resource_history[vps_id] = deque(maxlen=3600)
+                resource_history[vps_id] = ResourceRing(RESOURCE_RING_SIZE)
                 return render_template(
                     'vps_created.html',
                     vps=vps_data,
@@ -1503,10 +2661,30 @@ def vps_details(vps_id):
     if vps.get('status') == 'suspended':
         return render_template('vps_suspend.html', vps=vps)
    
-    history = db.get_resource_history(vps_id, 360)
+    now = time.time()
+    _, history = db.get_resource_history_range(vps_id, now - 1800, now)
     groups = db.get_vps_groups(vps_id)
     return render_template('vps_details.html', vps=vps, container_status=status, server_ip=db.get_setting('server_ip', SERVER_IP), panel_name=db.get_setting('panel_name', PANEL_NAME), history=history, groups=groups, theme=current_user.theme)
 
+@app.route('/vps/<vps_id>/history')
+@login_required
+def vps_history(vps_id):
+    token, vps = db.get_vps_by_id(vps_id)
+    if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
+        return jsonify({'error': 'Access denied'}), 403
+
+    try:
+        hours = min(max(float(request.args.get('hours', 0.5)), 0.1), 24 * 365)
+    except ValueError:
+        return jsonify({'error': 'Invalid range'}), 400
+    end = time.time()
+    resolution, history = db.get_resource_history_range(vps_id, end - hours * 3600, end)
+    for point in history:
+        for key in ('cpu_percent', 'cpu_min', 'cpu_max'):
+            if point.get(key) is not None:
+                point[key] = core_cpu_percent(point[key])
+    return jsonify({'resolution': resolution, 'history': history})
+
 @app.route('/vps/<vps_id>/start')
 @login_required
 def start_vps(vps_id):
@@ -1520,6 +2698,7 @@ def start_vps(vps_id):
             return jsonify({'error': 'Already running'}), 400
         container.start()
         db.update_vps(token, {'status': 'running', 'uptime_start': str(datetime.datetime.now())})
+        system_info_cache.invalidate(vps_id)
         db.log_action(current_user.id, 'start_vps', f'Started VPS {vps_id}')
         return jsonify({'message': 'Started'})
     except Exception as e:
@@ -1542,6 +2721,7 @@ def stop_vps(vps_id):
             return jsonify({'error': 'Already stopped'}), 400
         container.stop()
         db.update_vps(token, {'status': 'stopped'})
+        system_info_cache.invalidate(vps_id)
         db.log_action(current_user.id, 'stop_vps', f'Stopped VPS {vps_id}')
         return jsonify({'message': 'Stopped'})
     except Exception as e:
@@ -1568,6 +2748,8 @@ def restart_vps(vps_id):
             'uptime_start': str(datetime.datetime.now())
         }
         db.update_vps(token, updates)
+        system_info_cache.invalidate(vps_id)
+        stat_counter.increment('total_restarts')
         tmate = get_tmate_session(container.id)
         if tmate:
             db.update_vps(token, {'tmate_session': tmate})
@@ -1610,6 +2792,7 @@ def renew_vps(vps_id):
    
     new_expires = datetime.datetime.fromisoformat(vps['expires_at']) + datetime.timedelta(days=30)
     db.update_vps(token, {'expires_at': str(new_expires)})
+    expiry.schedule(vps_id, str(new_expires))
    
     if vps['status'] == 'expired':
         container = docker_client.containers.get(vps['container_id'])
@@ -1728,7 +2911,9 @@ def clone_vps(vps_id):
             'tags': vps['tags']
         }
        
-        db.add_vps(new_vps_data)
+        if db.add_vps(new_vps_data):
+            stat_counter.increment('total_vps_created')
+            expiry.schedule(new_vps_id, new_vps_data['expires_at'])
         db.log_action(current_user.id, 'clone_vps', f'Cloned VPS {vps_id} to {new_vps_id}')
         return render_template('vps_created.html', vps=new_vps_data, server_ip=db.get_setting('server_ip', SERVER_IP), panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
    
@@ -1737,6 +2922,8 @@ def clone_vps(vps_id):
         return render_template('error.html', error=str(e), panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
 ssh_clients = {}  # sid -> (ssh, chan)
+SHELL_SESSIONS.labels('ssh').set_function(lambda: len(ssh_clients))
+SHELL_SESSIONS.labels('console').set_function(lambda: len(console_sessions))
 
 @app.route('/vps/<vps_id>/console')
 @login_required
@@ -1833,9 +3020,15 @@ def ssh_input(data):
         cleanup_ssh(sid)
 
 
+@socketio.on('connect')
+def connect():
+    SOCKETIO_SESSIONS.labels('/').inc()
+
+
 @socketio.on('disconnect')
 def disconnect():
     """Clean up SSH connection when a client disconnects."""
+    SOCKETIO_SESSIONS.labels('/').dec()
     sid = request.sid
     cleanup_ssh(sid)
 
@@ -1854,112 +3047,66 @@ def cleanup_ssh(sid):
         except Exception:
             pass
 
+def collect_system_info(container_id):
+    internal = {}
+    cmds = [
+        ('free', ["free", "-h"]),
+        ('df', ["df", "-h"]),
+        ('uptime', ["uptime"]),
+        ('neofetch', ["neofetch", "--off"]),
+        ('top', ["top", "-b", "-n1"])
+    ]
+    for name, cmd in cmds:
+        success, out, err = run_docker_command(container_id, cmd, timeout=15)
+        internal[name] = out.strip() if success else f"Error: {err.strip()}"
+
+    success, out, err = run_docker_command(container_id, ["curl", "-s", "http://localhost:9100/metrics"], timeout=15)
+    metrics = out if success else "Metrics unavailable"
+
+    return {
+        'internal': internal,
+        'metrics': metrics,
+        'collected_at': datetime.datetime.now().isoformat()
+    }
+
 @app.route('/vps/<vps_id>/stats')
 @login_required
 def vps_stats(vps_id):
     token, vps = db.get_vps_by_id(vps_id)
     if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
         return jsonify({'error': 'Access denied'}), 403
+    if vps['status'] != 'running':
+        return jsonify({'error': 'Container not running'}), 400
 
     try:
-        container = docker_client.containers.get(vps['container_id'])
-        if container.status != 'running':
-            return jsonify({'error': 'Container not running'}), 400
-
-        stats = container.stats(stream=False)
-        mem_stats = stats.get('memory_stats', {})
-        cpu_stats = stats.get('cpu_stats', {})
-        net = stats.get('networks', {})
+        sample = container_sample(vps['container_id'])
 
         # ---- MEMORY ----
-        mem_usage = mem_stats.get('usage', 0)
-        mem_limit = mem_stats.get('limit', 1)
-        mem_usage_mb = mem_usage / (1024 ** 2)
-        mem_limit_mb = mem_limit / (1024 ** 2)
+        mem_usage = sample['memory_usage']
+        mem_limit = sample['memory_limit'] or 1
         mem_percent = round((mem_usage / mem_limit) * 100, 2) if mem_limit else 0
 
-        # ---- CPU ----
-        cpu_usage_info = cpu_stats.get('cpu_usage', {})
-        percpu_usage = cpu_usage_info.get('percpu_usage', [])
-        total_usage = cpu_usage_info.get('total_usage', 0)
-        system_cpu_usage = cpu_stats.get('system_cpu_usage', 0)
-
-        if system_cpu_usage > 0 and percpu_usage:
-            cpu_percent = (total_usage / system_cpu_usage) * len(percpu_usage) * 100
-        elif system_cpu_usage > 0:
-            cpu_percent = (total_usage / system_cpu_usage) * 100
-        else:
-            cpu_percent = 0
-
-        cpu_percent = round(min(cpu_percent, 100.0), 2)
-
-        # ---- DISK (REAL USAGE) ----
-        success, disk_out, disk_err = run_docker_command(vps['container_id'], ["df", "-BM", "/"])
-        disk_used_mb = disk_total_mb = disk_percent = 0
-
-        if success and disk_out:
-            try:
-                lines = disk_out.splitlines()
-                if len(lines) >= 2:
-                    parts = lines[1].split()
-                    disk_total_mb = int(parts[1].replace("M", "")) if len(parts) > 1 else 0
-                    disk_used_mb = int(parts[2].replace("M", "")) if len(parts) > 2 else 0
-                    disk_percent = round((disk_used_mb / disk_total_mb) * 100, 2) if disk_total_mb else 0
-            except Exception:
-                pass
-        else:
-            disk_err = disk_err or "Disk stats unavailable"
-
-        # ---- NETWORK ----
-        net_in = sum(i.get('rx_bytes', 0) for i in net.values()) / (1024 ** 2)
-        net_out = sum(i.get('tx_bytes', 0) for i in net.values()) / (1024 ** 2)
-
-        # ---- INTERNAL COMMANDS ----
-        internal = {}
-        cmds = [
-            ('free', ["free", "-h"]),
-            ('df', ["df", "-h"]),
-            ('uptime', ["uptime"]),
-            ('neofetch', ["neofetch", "--off"]),
-            ('top', ["top", "-b", "-n1"])
-        ]
-        for name, cmd in cmds:
-            success, out, err = run_docker_command(vps['container_id'], cmd)
-            internal[name] = out.strip() if success else f"Error: {err.strip()}"
-
-        # ---- PROMETHEUS METRICS ----
-        success, out, err = run_docker_command(vps['container_id'], ["curl", "-s", "http://localhost:9100/metrics"])
-        metrics = out if success else "Metrics unavailable"
-
-        # ---- BUILD RESPONSE ----
         return jsonify({
             'memory': {
-                'used_mb': round(mem_usage_mb, 2),
-                'limit_mb': round(mem_limit_mb, 2),
+                'used_mb': round(mem_usage / (1024 ** 2), 2),
+                'limit_mb': round(mem_limit / (1024 ** 2), 2),
                 'percent': mem_percent
             },
             'cpu': {
-                'percent': cpu_percent
-            },
-            'disk': {
-                'used_mb': round(disk_used_mb, 2),
-                'total_mb': round(disk_total_mb, 2),
-                'percent': disk_percent,
-                'error': disk_err if not success else None
+                'percent': round(min(sample['cpu_percent'], 100.0), 2)
             },
+            'disk': disk_accountant.get(vps_id),
             'network': {
-                'in_mb': round(net_in, 2),
-                'out_mb': round(net_out, 2)
+                'in_mb': round(sample['net_rx'] / (1024 ** 2), 2),
+                'out_mb': round(sample['net_tx'] / (1024 ** 2), 2)
             },
-            'uptime': stats.get('read', ''),
+            'uptime': vps.get('uptime_start', ''),
             'configured': {
                 'memory': f"{vps.get('memory', 0)}GB",
                 'cpu': f"{vps.get('cpu', 0)} cores",
                 'disk': f"{vps.get('disk', 0)}GB",
                 'bandwidth_limit': vps.get('bandwidth_limit', 'Unlimited')
-            },
-            'internal': internal,
-            'metrics': metrics
+            }
         })
 
     except docker.errors.NotFound:
@@ -1972,6 +3119,21 @@ def vps_stats(vps_id):
         logger.error(f"VPS stats error: {e}", exc_info=True)
         return jsonify({'error': f"Internal server error: {str(e)}"}), 500
 
+@app.route('/vps/<vps_id>/system_info')
+@login_required
+def vps_system_info(vps_id):
+    token, vps = db.get_vps_by_id(vps_id)
+    if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
+        return jsonify({'error': 'Access denied'}), 403
+    if vps['status'] != 'running':
+        return jsonify({'error': 'Container not running'}), 400
+
+    try:
+        return jsonify(system_info_cache.get(vps_id, lambda: collect_system_info(vps['container_id'])))
+    except Exception as e:
+        logger.error(f"VPS system info error: {e}", exc_info=True)
+        return jsonify({'error': f"Internal server error: {str(e)}"}), 500
+
 
 @app.route('/vps/<vps_id>/change_password', methods=['POST'])
 @login_required
@@ -2537,7 +3699,6 @@ def assign_group(group_id):
 @login_required
 @admin_required
 def admin_panel():
-    update_system_stats()
     all_vps = list(db.get_all_vps().values())
     all_users = db.get_all_users()
     banned = db.get_banned_users()
@@ -2558,8 +3719,8 @@ def admin_panel():
         'total_vps': len(all_vps),
         'total_users': len(all_users),
         'total_banned': len(banned),
-        'total_restarts': db.get_stat('total_restarts'),
-        'total_vps_created': db.get_stat('total_vps_created')
+        'total_restarts': stat_counter.get('total_restarts'),
+        'total_vps_created': stat_counter.get('total_vps_created')
     }
    
     audit_logs = db.get_audit_logs()
@@ -2620,6 +3781,7 @@ def edit_user(user_id):
         if password and len(password) < 8:
             return render_template('edit_user.html', error='Password too short', user=user, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
         if db.update_user(user_id, username=username, password=password, role=role, email=email):
+            invalidate_user_role(user_id)
             db.log_action(current_user.id, 'edit_user', f'Edited user {user_id}')
             return redirect(url_for('admin_panel'))
         return render_template('edit_user.html', error='Update failed', user=user, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
@@ -2631,6 +3793,7 @@ def edit_user(user_id):
 @admin_required
 def delete_user(user_id):
     if db.delete_user(user_id):
+        invalidate_user_role(user_id)
         db.log_action(current_user.id, 'delete_user', f'Deleted user {user_id}')
         return jsonify({'message': 'Deleted'})
     return jsonify({'error': 'Failed'}), 500
@@ -2641,6 +3804,7 @@ def delete_user(user_id):
 def ban_user(user_id):
     reason = request.form.get('reason', 'No reason provided')
     db.ban_user(int(user_id), reason)
+    invalidate_user_role(int(user_id))
     db.log_action(current_user.id, 'ban_user', f'Banned user {user_id} reason: {reason}')
     return redirect(url_for('admin_panel'))
 
@@ -2657,6 +3821,7 @@ def unban_user(user_id):
 @admin_required
 def make_admin(user_id):
     db.update_user_role(int(user_id), 'admin')
+    invalidate_user_role(int(user_id))
     db.log_action(current_user.id, 'make_admin', f'Made user {user_id} admin')
     return redirect(url_for('admin_panel'))
 
@@ -2665,6 +3830,7 @@ def make_admin(user_id):
 @admin_required
 def remove_admin(user_id):
     db.update_user_role(int(user_id), 'user')
+    invalidate_user_role(int(user_id))
     db.log_action(current_user.id, 'remove_admin', f'Removed admin from user {user_id}')
     return redirect(url_for('admin_panel'))
 
@@ -2712,10 +3878,10 @@ def admin_unsuspend_vps(vps_id):
 @login_required
 @admin_required
 def admin_backup():
-    if db.backup_data():
-        db.log_action(current_user.id, 'backup_system', 'Performed system backup')
-        return send_file(BACKUP_FILE, as_attachment=True)
-    return jsonify({'error': 'Backup failed'}), 500
+    db.log_action(current_user.id, 'backup_system', 'Performed system backup')
+    filename = f"hvm_panel_backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz"
+    return Response(stream_with_context(db.iter_backup()), mimetype='application/gzip',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/admin/restore', methods=['POST'])
 @login_required
@@ -2728,11 +3894,17 @@ def admin_restore():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
    
-    if file and file.filename.endswith('.json'):
-        file.save(BACKUP_FILE)
-        if db.restore_data():
-            db.log_action(current_user.id, 'restore_system', 'Restored system from backup')
-            return jsonify({'message': 'Restored'})
+    if file and file.filename.endswith(('.json', '.ndjson', '.gz')):
+        upload_path = os.path.join(UPLOAD_FOLDER, f'restore_{uuid.uuid4().hex}')
+        file.save(upload_path)
+        try:
+            result = db.restore_data(upload_path)
+        finally:
+            os.remove(upload_path)
+        if result:
+            expiry.load(db.get_all_vps())
+            db.log_action(current_user.id, 'restore_system', f"Restored {result['rows']} rows from backup")
+            return jsonify({'message': 'Restored', **result})
    
     return jsonify({'error': 'Failed'}), 500
 
@@ -2750,6 +3922,27 @@ def admin_docker_prune():
         logger.error(f"Docker prune error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/db_stats')
+@login_required
+@admin_required
+def admin_db_stats():
+    return jsonify(db.get_metrics())
+
+@app.route('/admin/jobs')
+@login_required
+@admin_required
+def admin_jobs():
+    jobs = scheduler.get_metrics()
+    if 'vps_stats' in jobs:
+        jobs['vps_stats']['collector'] = dict(stats_cycle_metrics)
+    return jsonify(jobs)
+
+@app.route('/admin/abuse')
+@login_required
+@admin_required
+def admin_abuse():
+    return jsonify(sorted(abuse_detector.decisions.values(), key=lambda d: d['score'], reverse=True))
+
 @app.route('/admin/export_vps')
 @login_required
 @admin_required
@@ -2781,10 +3974,11 @@ def export_users():
 
 @socketio.on('connect', namespace='/console')
 def handle_console_connect():
-    pass
+    SOCKETIO_SESSIONS.labels('/console').inc()
 
 @socketio.on('disconnect', namespace='/console')
 def handle_console_disconnect():
+    SOCKETIO_SESSIONS.labels('/console').dec()
     sid = request.sid
     if sid in console_sessions:
         os.killpg(os.getpgid(console_sessions[sid]['pid']), signal.SIGTERM)
@@ -2854,28 +4048,140 @@ def resize_handler(data):
 
 @socketio.on('connect', namespace='/admin')
 def handle_admin_connect():
+    SOCKETIO_SESSIONS.labels('/admin').inc()
     emit('system_stats', system_stats)
     emit('vps_stats', vps_stats_cache)
 
 @socketio.on('disconnect', namespace='/admin')
 def handle_admin_disconnect():
-    pass
+    SOCKETIO_SESSIONS.labels('/admin').dec()
+
+def build_live_stats(vps_id, vps):
+    if vps['status'] != 'running':
+        return {'status': vps['status']}
+    sample = container_sample(vps['container_id'])
+    mem_limit = sample['memory_limit'] or 1
+    return {
+        'status': 'running',
+        'cpu_percent': round(min(sample['cpu_percent'], 100.0), 1),
+        'memory_percent': round(sample['memory_usage'] / mem_limit * 100, 1),
+        'memory_used_mb': round(sample['memory_usage'] / (1024 ** 2), 1),
+        'disk_percent': disk_accountant.get(vps_id)['percent'],
+        'net_in_mb': round(sample['net_rx'] / (1024 ** 2), 2),
+        'net_out_mb': round(sample['net_tx'] / (1024 ** 2), 2),
+        'uptime': vps.get('uptime_start', '')
+    }
+
+class LiveStatsPublisher:
+    """Pushes delta-encoded stats to /vps rooms, collecting only for rooms that have subscribers."""
+
+    def __init__(self, interval=LIVE_STATS_INTERVAL, keyframe_every=LIVE_STATS_KEYFRAME_EVERY):
+        self.interval = interval
+        self.keyframe_every = keyframe_every
+        self.lock = threading.Lock()
+        self.rooms = {}
+        self.sids = {}
+
+    def subscribe(self, vps_id, sid):
+        with self.lock:
+            self.unsubscribe_locked(sid)
+            room = self.rooms.setdefault(vps_id, {'sids': set(), 'seq': -1, 'last': None, 'sent_at': 0.0})
+            room['sids'].add(sid)
+            self.sids[sid] = vps_id
+        return self.keyframe(vps_id)
+
+    def keyframe(self, vps_id):
+        with self.lock:
+            room = self.rooms.get(vps_id)
+            if room and room['last'] is not None:
+                return {'seq': room['seq'], 'stats': dict(room['last'])}
+        return None
+
+    def unsubscribe(self, sid):
+        with self.lock:
+            self.unsubscribe_locked(sid)
+
+    def unsubscribe_locked(self, sid):
+        vps_id = self.sids.pop(sid, None)
+        room = self.rooms.get(vps_id)
+        if room:
+            room['sids'].discard(sid)
+            if not room['sids']:
+                del self.rooms[vps_id]
+
+    def publish(self):
+        now = time.monotonic()
+        with self.lock:
+            due = [vps_id for vps_id, room in self.rooms.items() if now - room['sent_at'] >= self.interval]
+        for vps_id in due:
+            token, vps = db.get_vps_by_id(vps_id)
+            if not vps:
+                continue
+            try:
+                stats = build_live_stats(vps_id, vps)
+            except Exception as e:
+                logger.warning(f"Live stats for {vps_id} unavailable: {e}")
+                continue
+            with self.lock:
+                room = self.rooms.get(vps_id)
+                if room is None:
+                    continue
+                room['sent_at'] = now
+                last = room['last']
+                if last is None or (room['seq'] + 1) % self.keyframe_every == 0:
+                    event, payload = 'stats_full', {'stats': stats}
+                else:
+                    changes = {key: value for key, value in stats.items() if last.get(key) != value}
+                    if not changes:
+                        continue
+                    event, payload = 'stats_delta', {'changes': changes}
+                room['seq'] += 1
+                room['last'] = stats
+                payload['seq'] = room['seq']
+            socketio.emit(event, payload, room=vps_id, namespace='/vps')
+
+live_stats = LiveStatsPublisher()
 
 @socketio.on('connect', namespace='/vps')
 def handle_vps_connect():
-    pass
+    if not current_user.is_authenticated:
+        return False
+    SOCKETIO_SESSIONS.labels('/vps').inc()
+
+@socketio.on('disconnect', namespace='/vps')
+def handle_vps_disconnect():
+    SOCKETIO_SESSIONS.labels('/vps').dec()
+    live_stats.unsubscribe(request.sid)
 
 @socketio.on('join_vps', namespace='/vps')
 def join_vps(data):
     vps_id = data['vps_id']
+    token, vps = db.get_vps_by_id(vps_id)
+    if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
+        emit('error', {'message': 'Access denied'})
+        return
     join_room(vps_id)
+    keyframe = live_stats.subscribe(vps_id, request.sid)
+    if keyframe:
+        emit('stats_full', keyframe)
     if vps_id in resource_history:
-        emit('history', list(resource_history[vps_id]))
+        history = resource_history[vps_id].to_dict(LIVE_HISTORY_POINTS)
+        history['cpu'] = [core_cpu_percent(value) for value in history['cpu']]
+        emit('history', history)
+
+@socketio.on('resync_vps', namespace='/vps')
+def resync_vps(data):
+    if live_stats.sids.get(request.sid) != data['vps_id']:
+        return
+    keyframe = live_stats.keyframe(data['vps_id'])
+    if keyframe:
+        emit('stats_full', keyframe)
 
 @socketio.on('leave_vps', namespace='/vps')
 def leave_vps(data):
     vps_id = data['vps_id']
     leave_room(vps_id)
+    live_stats.unsubscribe(request.sid)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -2884,106 +4190,71 @@ def load_user(user_id):
         return User(user_data['id'], user_data['username'], user_data['role'], user_data.get('email'), user_data.get('theme', 'light'))
     return None
 
-def system_stats_updater():
-    while True:
-        update_system_stats()
-        socketio.emit('system_stats', system_stats, namespace='/admin')
-        time.sleep(10)
+def publish_system_stats():
+    update_system_stats()
+    socketio.emit('system_stats', system_stats, namespace='/admin')
 
-def vps_stats_updater():
-    while True:
-        update_vps_stats()
-        socketio.emit('vps_stats', vps_stats_cache, namespace='/admin')
-        time.sleep(5)
+def publish_vps_stats(all_vps):
+    update_vps_stats(all_vps)
+    socketio.emit('vps_stats', vps_stats_cache, namespace='/admin')
 
-def anti_miner_monitor():
-    while True:
-        for token, vps in db.get_all_vps().items():
-            if vps['status'] != 'running':
-                continue
-            container = docker_client.containers.get(vps['container_id'])
-            stats = container.stats(stream=False)
-            cpu = (stats['cpu_stats']['cpu_usage']['total_usage'] / stats['cpu_stats']['system_cpu_usage']) * 100 if 'system_cpu_usage' in stats['cpu_stats'] else 0
-            if cpu > 95:
-                container.stop()
-                db.update_vps(token, {'status': 'suspended'})
-                db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} suspended due to high CPU')
-                continue
-            success, out, _ = run_docker_command(vps['container_id'], ["ps", "aux"])
-            if success:
-                for pattern in MINER_PATTERNS:
-                    if pattern in out.lower():
-                        container.stop()
-                        db.update_vps(token, {'status': 'suspended'})
-                        db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} suspended due to mining activity')
-                        break
-        time.sleep(120)
-
-def clean_stopped_containers():
-    while True:
-        stopped = docker_client.containers.list(filters={"status": "exited"})
-        for cont in stopped:
-            if cont.id not in [v['container_id'] for v in db.get_all_vps().values()]:
-                cont.remove()
-        time.sleep(600)
-
-def check_expired_vps():
-    while True:
-        now = datetime.datetime.now()
-        for vps_id, vps in db.get_all_vps().items():
-            if vps.get('expires_at'):
-                expires = datetime.datetime.fromisoformat(vps['expires_at'])
-                if now > expires and vps['status'] != 'expired':
-                    try:
-                        container = docker_client.containers.get(vps['container_id'])
-                        container.stop()
-                        container.remove()
-                        db.update_vps(vps['token'], {'status': 'expired'})
-                        db.add_notification(vps['created_by'], f'VPS {vps_id} has expired')
-                        user = db.get_user_by_id(vps['created_by'])
-                        if user.get('email'):
-                            send_email(user['email'], 'VPS Expired', f'Your VPS {vps_id} has expired.')
-                    except:
-                        pass
-        time.sleep(60)
+def anti_miner_monitor(all_vps):
+    suspended = anti_miner.scan(all_vps)
+    if suspended:
+        logger.info(f"Anti-miner suspended {suspended} VPS")
 
-def monitor_containers():
-    while True:
-        for token, vps in db.get_all_vps().items():
+def clean_stopped_containers(all_vps):
+    if not container_index.ready.is_set():
+        return
+    known = {v['container_id'] for v in all_vps.values()}
+    for container_id in container_index.exited():
+        if container_id not in known:
             try:
-                cont = docker_client.containers.get(vps['container_id'])
-                status = cont.status
-                expires = datetime.datetime.fromisoformat(vps['expires_at'])
-                if datetime.datetime.now() > expires and status == 'running':
-                    cont.stop()
-                    db.update_vps(token, {'status': 'expired'})
-                    socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': 'expired'}, namespace='/admin')
-                    continue
-                if status != vps['status']:
-                    db.update_vps(token, {'status': status})
-                    socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': status}, namespace='/admin')
+                docker_client.api.remove_container(container_id)
             except docker.errors.NotFound:
-                if vps['status'] != 'not_found':
-                    db.update_vps(token, {'status': 'not_found'})
-                    socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': 'not_found'}, namespace='/admin')
-        time.sleep(15)
-
-def scheduled_backups():
-    while True:
-        if BACKUP_SCHEDULE == 'daily':
-            time.sleep(86400)
-        elif BACKUP_SCHEDULE == 'hourly':
-            time.sleep(3600)
-        db.backup_data()
-        logger.info("Scheduled backup performed")
-
-threading.Thread(target=system_stats_updater, daemon=True).start()
-threading.Thread(target=vps_stats_updater, daemon=True).start()
-threading.Thread(target=anti_miner_monitor, daemon=True).start()
-threading.Thread(target=clean_stopped_containers, daemon=True).start()
-threading.Thread(target=check_expired_vps, daemon=True).start()
-threading.Thread(target=monitor_containers, daemon=True).start()
-threading.Thread(target=scheduled_backups, daemon=True).start()
+                pass
+
+def monitor_containers():
+    container_index.reconcile()
+
+def resource_history_maintenance():
+    db.rollup_resource_history()
+    pruned = db.prune_resource_history()
+    if pruned:
+        logger.info(f"Pruned {pruned} resource history rows")
+
+def disk_accounting(all_vps):
+    scanned = disk_accountant.refresh(all_vps)
+    logger.debug(f"Disk accounting scanned {scanned} volumes")
+
+def email_outbox_maintenance():
+    pruned = email_outbox.prune(EMAIL_RETENTION_DAYS * 86400)
+    if pruned:
+        logger.info(f"Pruned {pruned} email outbox rows")
+
+def scheduled_backup():
+    db.backup_data()
+    logger.info("Scheduled backup performed")
+
+scheduler = Scheduler()
+scheduler.add('system_stats', publish_system_stats, 10)
+scheduler.add('vps_stats', publish_vps_stats, 5, snapshot=True)
+scheduler.add('live_stats', live_stats.publish, min(1.0, LIVE_STATS_INTERVAL), jitter=0)
+scheduler.add('anti_miner', anti_miner_monitor, 120, snapshot=True)
+scheduler.add('clean_stopped_containers', clean_stopped_containers, 600, snapshot=True)
+scheduler.add('monitor_containers', monitor_containers, CONTAINER_RESYNC_INTERVAL, initial_delay=CONTAINER_RESYNC_INTERVAL)
+scheduler.add('resource_history_maintenance', resource_history_maintenance, 300)
+scheduler.add('disk_accounting', disk_accounting, DISK_ACCOUNTING_INTERVAL, snapshot=True)
+scheduler.add('email_outbox_maintenance', email_outbox_maintenance, 3600)
+BACKUP_INTERVALS = {'daily': 86400, 'hourly': 3600}
+if BACKUP_SCHEDULE in BACKUP_INTERVALS:
+    scheduler.add('scheduled_backup', scheduled_backup, BACKUP_INTERVALS[BACKUP_SCHEDULE], jitter=0.01, initial_delay=BACKUP_INTERVALS[BACKUP_SCHEDULE])
+scheduler.start()
+atexit.register(scheduler.stop)
+threading.Thread(target=container_index.listen, name='docker-events', daemon=True).start()
+expiry.load(db.get_all_vps())
+expiry.start()
+atexit.register(expiry.stop)
 
 
 __version__ = "4.0"
@@ -3042,4 +4313,5 @@ if __name__ == '__main__':
             else:
                 print(f"Invalid key: {msg_or_data}")
 
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     socketio.run(app, host='0.0.0.0', port=SERVER_PORT, debug=DEBUG)
\ No newline at end of file
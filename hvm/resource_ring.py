@@ -0,0 +1,55 @@
+import threading
+from array import array
+
+class ResourceRing:
+    """Fixed-size columnar ring of live samples for one VPS, 24 bytes per slot."""
+
+    COLUMNS = ('cpu', 'memory', 'disk', 'net_in', 'net_out')
+
+    def __init__(self, capacity=3600):
+        self.capacity = capacity
+        self.timestamps = array('I', [0]) * capacity
+        self.columns = {name: array('f', [0.0]) * capacity for name in self.COLUMNS}
+        self.head = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return sum(col.itemsize * len(col) for col in (self.timestamps, *self.columns.values()))
+
+    def append(self, timestamp, cpu, memory, disk, net_in, net_out):
+        with self.lock:
+            i = self.head
+            self.timestamps[i] = int(timestamp)
+            for name, value in zip(self.COLUMNS, (cpu, memory, disk, net_in, net_out)):
+                self.columns[name][i] = value
+            self.head = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    def views(self, last=None):
+        """Return the newest samples per column as one or two memoryview segments, oldest first."""
+        with self.lock:
+            n = self.size if last is None else min(last, self.size)
+            start = (self.head - n) % self.capacity
+            end = start + n
+
+            def window(arr):
+                view = memoryview(arr)
+                if end <= self.capacity:
+                    return (view[start:end],)
+                return (view[start:], view[:end - self.capacity])
+
+            result = {name: window(col) for name, col in self.columns.items()}
+            result['timestamp'] = window(self.timestamps)
+        return result
+
+    def to_dict(self, last=None):
+        result = {}
+        for name, segments in self.views(last).items():
+            values = [value for segment in segments for value in segment.tolist()]
+            result[name] = values if name == 'timestamp' else [round(value, 2) for value in values]
+        return result
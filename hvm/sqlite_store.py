@@ -0,0 +1,179 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+class SQLiteStore:
+    """Bounded pool of WAL connections with a single serialized writer."""
+
+    def __init__(self, db_file, busy_timeout=5.0, pool_size=8):
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._pool = queue.LifoQueue()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._column_cache = {}
+        self.metrics = {
+            'connections_opened': 0,
+            'pool_waits': 0,
+            'write_lock_acquisitions': 0,
+            'write_lock_wait_seconds': 0.0,
+            'write_lock_wait_max': 0.0,
+            'writes': 0,
+            'reads': 0,
+            'query_seconds': 0.0,
+            'query_max': 0.0
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=self.busy_timeout, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        self._connections.append(conn)
+        self._record('connections_opened')
+        return conn, conn.cursor()
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._connections_lock:
+            if len(self._connections) < self.pool_size:
+                return self._connect()
+        self._record('pool_waits')
+        try:
+            return self._pool.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('database connection pool exhausted')
+
+    @contextmanager
+    def _connection(self):
+        # Werkzeug's threaded server runs each request on a fresh thread, so
+        # connections are leased from a bounded pool rather than tied to a
+        # thread.  Nested calls on the same thread reuse the outer lease.
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            yield lease
+            return
+        lease = self._acquire()
+        self._local.lease = lease
+        try:
+            yield lease
+        finally:
+            self._local.lease = None
+            if lease[0].in_transaction:
+                lease[0].rollback()
+            self._pool.put(lease)
+
+    def _record(self, counter):
+        with self._metrics_lock:
+            self.metrics[counter] += 1
+
+    def _record_lock_wait(self, elapsed):
+        with self._metrics_lock:
+            self.metrics['write_lock_acquisitions'] += 1
+            self.metrics['write_lock_wait_seconds'] += elapsed
+            self.metrics['write_lock_wait_max'] = max(self.metrics['write_lock_wait_max'], elapsed)
+
+    def _record_query(self, kind, elapsed):
+        with self._metrics_lock:
+            self.metrics[kind] += 1
+            self.metrics['query_seconds'] += elapsed
+            self.metrics['query_max'] = max(self.metrics['query_max'], elapsed)
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        with self._connections_lock:
+            metrics['connections_open'] = len(self._connections)
+        metrics['connections_idle'] = self._pool.qsize()
+        return metrics
+
+    @contextmanager
+    def transaction(self):
+        # The write lock is taken before a connection is leased, so writers
+        # queued behind a long transaction do not drain the pool for readers.
+        waited = time.perf_counter()
+        if not self.lock.acquire(timeout=self.busy_timeout):
+            raise sqlite3.OperationalError('database is locked')
+        try:
+            started = time.perf_counter()
+            self._record_lock_wait(started - waited)
+            with self._connection() as (conn, cursor):
+                try:
+                    if not conn.in_transaction:
+                        cursor.execute('BEGIN IMMEDIATE')
+                    yield cursor
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    self._record_query('writes', time.perf_counter() - started)
+        finally:
+            self.lock.release()
+
+    def _execute(self, query, params=()):
+        with self.transaction() as cursor:
+            cursor.execute(query, params)
+            return cursor.rowcount
+
+    def _fetchone(self, query, params=()):
+        with self._connection() as (conn, cursor):
+            started = time.perf_counter()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchone()
+            finally:
+                self._record_query('reads', time.perf_counter() - started)
+
+    def _fetchall(self, query, params=()):
+        with self._connection() as (conn, cursor):
+            started = time.perf_counter()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                self._record_query('reads', time.perf_counter() - started)
+
+    def _columns(self, query, cursor):
+        columns = self._column_cache.get(query)
+        if columns is None:
+            columns = self._column_cache[query] = tuple(desc[0] for desc in cursor.description)
+        return columns
+
+    def _fetchone_dict(self, query, params=()):
+        with self._connection() as (conn, cursor):
+            started = time.perf_counter()
+            try:
+                cursor.execute(query, params)
+                row = cursor.fetchone()
+                return dict(zip(self._columns(query, cursor), row)) if row else None
+            finally:
+                self._record_query('reads', time.perf_counter() - started)
+
+    def _fetchall_dicts(self, query, params=()):
+        with self._connection() as (conn, cursor):
+            started = time.perf_counter()
+            try:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                columns = self._columns(query, cursor)
+                return [dict(zip(columns, row)) for row in rows]
+            finally:
+                self._record_query('reads', time.perf_counter() - started)
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._pool = queue.LifoQueue()
+        self._local = threading.local()
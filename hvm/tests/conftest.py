@@ -0,0 +1,87 @@
+import os
+import socketserver
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """In-process SMTP server that records sessions and messages for tests."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSession)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.commands = []
+        self.messages = []
+        self.rcpt_replies = {}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPSession(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+        self.reply('220 sink ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb, _, argument = line.decode().strip().partition(' ')
+            verb = verb.upper()
+            with sink.lock:
+                sink.commands.append(verb)
+            if verb in ('EHLO', 'HELO', 'MAIL', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = argument.partition(':')[2].strip('<> ')
+                reply = sink.rcpt_replies.get(address, '250 OK')
+                if reply == 'drop':
+                    return
+                if reply.startswith('250'):
+                    recipients.append(address)
+                self.reply(reply)
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if chunk in (b'.\r\n', b''):
+                        break
+                    data.append(chunk)
+                with sink.lock:
+                    sink.messages.append((recipients, b''.join(data).decode()))
+                recipients = []
+                self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 command not implemented')
+
+
+@pytest.fixture
+def smtp_sink():
+    sink = SMTPSink()
+    thread = threading.Thread(target=sink.serve_forever, daemon=True)
+    thread.start()
+    yield sink
+    sink.shutdown()
+    sink.server_close()
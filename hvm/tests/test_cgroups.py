@@ -0,0 +1,76 @@
+import os
+
+from cgroups import CgroupReader
+
+CONTAINER = 'abc123'
+
+NET_DEV = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:    5000      10    0    0    0     0          0         0     5000      10    0    0    0     0       0          0
+  eth0: 1048576     100    0    0    0     0          0         0   524288      50    0    0    0     0       0          0
+"""
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def make_tree(tmp_path, usage_usec=1000000, memory_max='max'):
+    cgroup_root = tmp_path / 'cgroup'
+    proc_root = tmp_path / 'proc'
+    scope = cgroup_root / 'system.slice' / f'docker-{CONTAINER}.scope'
+    write(str(cgroup_root / 'cgroup.controllers'), 'cpu io memory pids\n')
+    write(str(scope / 'cpu.stat'), f'usage_usec {usage_usec}\nuser_usec 600000\nsystem_usec 400000\n')
+    write(str(scope / 'memory.current'), '268435456\n')
+    write(str(scope / 'memory.max'), f'{memory_max}\n')
+    write(str(scope / 'io.stat'), '8:0 rbytes=4096 wbytes=8192 rios=1 wios=2\n259:0 rbytes=1000 wbytes=0 rios=1 wios=0\n')
+    write(str(scope / 'cgroup.procs'), '4242\n4243\n')
+    write(str(proc_root / '4242' / 'net' / 'dev'), NET_DEV)
+    write(str(proc_root / 'meminfo'), 'MemTotal:        2048000 kB\nMemFree:          100000 kB\n')
+    return str(cgroup_root), str(proc_root), scope
+
+
+def test_read_parses_fake_tree(tmp_path):
+    cgroup_root, proc_root, _ = make_tree(tmp_path)
+    reader = CgroupReader(cgroup_root, proc_root)
+    assert reader.available
+    sample = reader.read(CONTAINER, now=100.0)
+    assert sample['cpu_percent'] == 0.0
+    assert sample['memory_usage'] == 268435456
+    assert sample['memory_limit'] == 2048000 * 1024
+    assert (sample['io_read'], sample['io_write']) == (5096, 8192)
+    assert (sample['net_rx'], sample['net_tx']) == (1048576, 524288)
+    assert reader.pids(CONTAINER) == [4242, 4243]
+
+
+def test_cpu_percent_is_usage_delta_over_wall_time(tmp_path):
+    cgroup_root, proc_root, scope = make_tree(tmp_path, memory_max='536870912')
+    reader = CgroupReader(cgroup_root, proc_root)
+    reader.read(CONTAINER, now=100.0)
+    write(str(scope / 'cpu.stat'), 'usage_usec 4000000\n')
+    sample = reader.read(CONTAINER, now=102.0)
+    assert sample['cpu_percent'] == 150.0
+    assert sample['cpu_host_percent'] == 150.0 / reader.host_cpus
+    assert sample['memory_limit'] == 536870912
+
+
+def test_unknown_container_and_missing_cgroup2(tmp_path):
+    cgroup_root, proc_root, _ = make_tree(tmp_path)
+    reader = CgroupReader(cgroup_root, proc_root)
+    assert reader.read('missing') is None
+    assert reader.readable(CONTAINER) and not reader.readable('missing')
+    assert reader.sample_all(['missing']) == {}
+    os.remove(os.path.join(cgroup_root, 'cgroup.controllers'))
+    assert CgroupReader(cgroup_root, proc_root).sample_all([CONTAINER]) == {}
+
+
+def test_sample_all_caches_fresh_samples(tmp_path):
+    cgroup_root, proc_root, _ = make_tree(tmp_path)
+    reader = CgroupReader(cgroup_root, proc_root, max_age=10)
+    samples = reader.sample_all([CONTAINER, 'missing'])
+    assert list(samples) == [CONTAINER]
+    assert reader.get(CONTAINER) is samples[CONTAINER]
+    samples[CONTAINER]['read_at'] -= 11
+    assert reader.get(CONTAINER) is None
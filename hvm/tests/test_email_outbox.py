@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from email_outbox import EmailOutbox
+from sqlite_store import SQLiteStore
+
+
+@pytest.fixture
+def outbox(tmp_path, smtp_sink):
+    store = SQLiteStore(str(tmp_path / 'panel.db'))
+    outbox = EmailOutbox(store, '127.0.0.1', smtp_sink.port, 'panel@example.com', '', starttls=False, timeout=5,
+                         retry_base=60, max_attempts=3)
+    yield outbox
+    outbox._close()
+    store.close()
+
+
+def rows(outbox):
+    return {row['to_email']: row for row in outbox.store._fetchall_dicts('SELECT * FROM email_outbox')}
+
+
+def test_batches_over_one_session(outbox, smtp_sink):
+    for i in range(5):
+        outbox.enqueue(f'user{i}@example.com', 'Welcome', 'Your account has been created.')
+    assert outbox.flush() == 5
+    for i in range(5, 8):
+        outbox.enqueue(f'user{i}@example.com', 'Welcome', 'Your account has been created.')
+    assert outbox.flush() == 3
+    assert smtp_sink.connections == 1
+    assert smtp_sink.commands.count('NOOP') == 1
+    assert len(smtp_sink.messages) == 8
+    assert {row['status'] for row in rows(outbox).values()} == {'sent'}
+
+
+def test_repeated_alert_is_deduplicated(outbox, smtp_sink):
+    assert outbox.enqueue('user@example.com', 'VPS Expired', 'Your VPS abc has expired.')
+    assert not outbox.enqueue('user@example.com', 'VPS Expired', 'Your VPS abc has expired.')
+    assert outbox.enqueue('user@example.com', 'VPS Expired', 'Your VPS def has expired.')
+    assert outbox.flush() == 2
+    assert len(smtp_sink.messages) == 2
+
+
+def test_temporary_failure_backs_off(outbox, smtp_sink):
+    smtp_sink.rcpt_replies['busy@example.com'] = '451 try again later'
+    outbox.enqueue('busy@example.com', 'Welcome', 'hello')
+    outbox.enqueue('ok@example.com', 'Welcome', 'hello')
+    before = time.time()
+    assert outbox.flush() == 1
+    row = rows(outbox)['busy@example.com']
+    assert (row['status'], row['attempts']) == ('pending', 1)
+    assert before + 60 - 1 <= row['next_attempt'] <= time.time() + 60
+    assert outbox.flush() == 0
+
+    outbox.store._execute('UPDATE email_outbox SET next_attempt = 0')
+    assert outbox.flush() == 0
+    row = rows(outbox)['busy@example.com']
+    assert row['attempts'] == 2
+    assert row['next_attempt'] >= before + 120 - 1
+
+    outbox.store._execute('UPDATE email_outbox SET next_attempt = 0')
+    outbox.flush()
+    assert rows(outbox)['busy@example.com']['status'] == 'failed'
+
+
+def test_dropped_connection_retries_and_reconnects(outbox, smtp_sink):
+    smtp_sink.rcpt_replies['drop@example.com'] = 'drop'
+    outbox.enqueue('drop@example.com', 'Welcome', 'hello')
+    outbox.enqueue('after@example.com', 'Welcome', 'hello')
+    assert outbox.flush() == 1
+    assert smtp_sink.connections == 2
+    assert [recipients for recipients, _ in smtp_sink.messages] == [['after@example.com']]
+    row = rows(outbox)['drop@example.com']
+    assert (row['status'], row['attempts']) == ('pending', 1)
+    assert row['next_attempt'] > time.time()
+
+
+def test_permanent_failure_is_marked_failed(outbox, smtp_sink):
+    smtp_sink.rcpt_replies['gone@example.com'] = '550 no such user'
+    outbox.enqueue('gone@example.com', 'Welcome', 'hello')
+    assert outbox.flush() == 0
+    row = rows(outbox)['gone@example.com']
+    assert (row['status'], row['attempts']) == ('failed', 1)
+    assert '550' in row['last_error']
+
+
+def test_unreachable_server_defers_whole_batch(tmp_path, smtp_sink):
+    store = SQLiteStore(str(tmp_path / 'panel.db'))
+    port = smtp_sink.port
+    smtp_sink.shutdown()
+    smtp_sink.server_close()
+    outbox = EmailOutbox(store, '127.0.0.1', port, 'panel@example.com', '', starttls=False, timeout=1)
+    outbox.enqueue('a@example.com', 'Welcome', 'hello')
+    outbox.enqueue('b@example.com', 'Welcome', 'hello')
+    assert outbox.flush() == 0
+    assert {(row['status'], row['attempts']) for row in rows(outbox).values()} == {('pending', 1)}
+    store.close()
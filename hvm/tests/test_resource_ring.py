@@ -0,0 +1,40 @@
+from resource_ring import ResourceRing
+
+
+def fill(ring, count, start=1000):
+    for i in range(count):
+        ring.append(start + i, i, i + 0.5, 10, i * 2, i * 3)
+
+
+def test_full_ring_footprint():
+    ring = ResourceRing(3600)
+    fill(ring, 4000)
+    assert len(ring) == 3600
+    # five float32 columns plus a uint32 timestamp: 24 bytes per slot
+    assert ring.nbytes == 3600 * 24 == 86400
+
+
+def test_views_split_when_window_wraps():
+    ring = ResourceRing(8)
+    fill(ring, 11)
+    views = ring.views()
+    assert [len(segment) for segment in views['timestamp']] == [5, 3]
+    assert [value for segment in views['timestamp'] for value in segment.tolist()] == list(range(1003, 1011))
+    assert [len(segment) for segment in ring.views(2)['cpu']] == [2]
+
+
+def test_to_dict_returns_newest_samples_oldest_first():
+    ring = ResourceRing(8)
+    fill(ring, 11)
+    history = ring.to_dict(4)
+    assert history['timestamp'] == [1007, 1008, 1009, 1010]
+    assert history['cpu'] == [7.0, 8.0, 9.0, 10.0]
+    assert history['memory'] == [7.5, 8.5, 9.5, 10.5]
+    assert history['net_out'] == [21.0, 24.0, 27.0, 30.0]
+
+
+def test_partial_ring():
+    ring = ResourceRing(8)
+    fill(ring, 3)
+    assert ring.to_dict()['timestamp'] == [1000, 1001, 1002]
+    assert ring.to_dict(10)['cpu'] == [0.0, 1.0, 2.0]
@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from sqlite_store import SQLiteStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'panel.db'), busy_timeout=1.0, pool_size=4)
+    store._execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+    store._execute("INSERT INTO items (name) VALUES ('a'), ('b')")
+    yield store
+    store.close()
+
+
+def test_execute_returns_rowcount(store):
+    assert store._execute("UPDATE items SET name = 'c'") == 2
+    assert store._execute('DELETE FROM items WHERE id = 99') == 0
+
+
+def test_reads_succeed_while_writers_queue_behind_long_transaction(store):
+    in_transaction = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def long_write():
+        with store.transaction() as cursor:
+            cursor.execute("INSERT INTO items (name) VALUES ('slow')")
+            in_transaction.set()
+            release.wait()
+
+    def queued_write():
+        try:
+            store._execute("INSERT INTO items (name) VALUES ('queued')")
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    holder = threading.Thread(target=long_write)
+    holder.start()
+    in_transaction.wait()
+    writers = [threading.Thread(target=queued_write) for _ in range(store.pool_size * 2)]
+    for writer in writers:
+        writer.start()
+    time.sleep(0.1)
+
+    started = time.perf_counter()
+    for _ in range(20):
+        assert store._fetchone('SELECT COUNT(*) FROM items')[0] == 2
+    assert time.perf_counter() - started < 0.5
+
+    release.set()
+    holder.join()
+    for writer in writers:
+        writer.join()
+    assert not errors
+    assert store._fetchone('SELECT COUNT(*) FROM items')[0] == 3 + store.pool_size * 2
+
+
+def test_write_lock_wait_is_bounded(store):
+    in_transaction = threading.Event()
+    release = threading.Event()
+
+    def long_write():
+        with store.transaction():
+            in_transaction.set()
+            release.wait()
+
+    holder = threading.Thread(target=long_write)
+    holder.start()
+    in_transaction.wait()
+    started = time.perf_counter()
+    with pytest.raises(sqlite3.OperationalError):
+        store._execute("INSERT INTO items (name) VALUES ('late')")
+    assert time.perf_counter() - started < store.busy_timeout + 0.5
+    assert store._fetchall_dicts('SELECT name FROM items ORDER BY id') == [{'name': 'a'}, {'name': 'b'}]
+    release.set()
+    holder.join()